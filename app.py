@@ -6,15 +6,26 @@ if os.name != "nt" and os.name != "posix":
 
     sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
-from dotenv import load_dotenv
-from flask import Flask
-from flask import request
-from waitress import serve
-from controller.receipt import receipt_blueprint
-from controller.intelligent import intelligent_blueprint
+from service.startup import STARTUP_WARMUP, startup_report, warmup
 
+with startup_report.timed("import", "dotenv"):
+    from dotenv import load_dotenv
+
+# Before the controllers: service settings are read from the environment on import
 load_dotenv(override=True)
 
+with startup_report.timed("import", "flask"):
+    from flask import Flask, jsonify
+    from flask import request
+# Heavy SDKs (google.generativeai, Firestore, fitz, PIL) are imported on first
+# use, so these only load the Flask routes and their settings
+with startup_report.timed("import", "controller.receipt"):
+    from controller.receipt import receipt_blueprint
+with startup_report.timed("import", "controller.intelligent"):
+    from controller.intelligent import get_extraction_jobs, intelligent_blueprint
+
+PORT = int(os.getenv("PORT", 8180))
+
 app = Flask(__name__)
 
 
@@ -27,6 +38,27 @@ def index():
     return "Flask app!"
 
 
+@app.route('/startup-stats')
+def startup_stats():
+    return jsonify(startup_report.stats()), 200
+
+
+def warmup_steps():
+    """Clients created by ``STARTUP_WARMUP`` instead of by the first request needing them."""
+    from service.receipt_repository import RECEIPT_BACKEND, get_firestore_client
+    from service.receipt_search import get_search_index
+    steps = [get_search_index, get_extraction_jobs]
+    if RECEIPT_BACKEND == "firestore":
+        steps.insert(0, get_firestore_client)
+    return steps
+
+
+startup_report.mark_ready()
+if STARTUP_WARMUP:
+    warmup(warmup_steps())
+
+
 if __name__ == '__main__':
-    print("Server running with eventlet...")
-    serve(app, host='0.0.0.0', port=8180)
+    from waitress import serve
+    print(f"Server running on port {PORT} (ready in {startup_report.ready_seconds}s)...")
+    serve(app, host='0.0.0.0', port=PORT)
@@ -0,0 +1,77 @@
+"""Compare one-receipt-per-request ingestion with the bulk endpoint.
+
+Posts the same synthetic receipts through ``/receipt/add-receipts`` one at a
+time and through ``/receipt/add-receipts/bulk`` once, using Flask's test
+client, then deletes what it wrote. The two runs use different receipts so
+duplicate detection does not turn the bulk run into lookups only. ``--backend memory`` swaps in the
+in-memory repository to measure just the HTTP/validation overhead.
+
+    python -m benchmarks.bulk_ingest --count 300 [--backend memory]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from app import app
+from service.receipt import invalidate_receipts
+from service.receipt_rollups import rollup_changes
+from service.receipt_search import get_search_index
+from service.receipt_repository import (
+    InMemoryReceiptRepository, get_receipt_repository, set_receipt_repository
+)
+
+
+def make_receipts(count, offset=0):
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "biller_name": f"Bench Store {i % 17}",
+            "bill_value": round(10 + (offset + i) * 0.37, 2),
+            "date": (start + timedelta(days=i % 365)).isoformat(),
+            "items": [{"item": "bench item", "price": "1.00"}],
+        }
+        for i in range(count)
+    ]
+
+
+def cleanup(ids):
+    get_receipt_repository().delete_many(ids, rollup=rollup_changes)
+    for receipt_id in ids:
+        get_search_index().remove(receipt_id)
+    invalidate_receipts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--backend", choices=["firestore", "memory"], default="firestore")
+    args = parser.parse_args()
+    if args.backend == "memory":
+        set_receipt_repository(InMemoryReceiptRepository())
+
+    receipts = make_receipts(args.count)
+    client = app.test_client()
+    created = []
+
+    started = time.perf_counter()
+    for receipt in receipts:
+        response = client.post("/receipt/add-receipts", json=receipt)
+        created.append(response.get_json().get("id"))
+    single_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.post("/receipt/add-receipts/bulk", json=make_receipts(args.count, args.count))
+    bulk_s = time.perf_counter() - started
+    body = response.get_json()
+    created.extend(r["id"] for r in body["results"] if "id" in r)
+
+    cleanup([receipt_id for receipt_id in created if receipt_id])
+
+    print(f"Receipts: {args.count}")
+    print(f"Single-item path: {single_s:.2f}s ({args.count / single_s:.1f} receipts/s)")
+    print(f"Bulk path:        {bulk_s:.2f}s ({args.count / bulk_s:.1f} receipts/s), "
+          f"added={body['added']} failed={body['failed']}")
+    print(f"Speed-up: {single_s / bulk_s:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Measure cold start: time from launching the server to its first ``/`` response.
+
+Starts ``app.py`` in a fresh interpreter on a free port, polls ``GET /``
+until it answers, then reads ``/startup-stats`` for the per-import and
+per-client breakdown of that process and stops it. Repeated ``--repeat``
+times; ``--warmup`` sets ``STARTUP_WARMUP=1`` in the child to see what the
+background warmup costs the first response.
+
+    python -m benchmarks.cold_start [--repeat 5] [--warmup]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url, timeout=1.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def cold_start(warmup=False, timeout=60.0):
+    """``(seconds to first response, startup report)`` of one fresh server."""
+    port = free_port()
+    env = {**os.environ, "PORT": str(port), "STARTUP_WARMUP": "1" if warmup else "0"}
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "app.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited: {process.stderr.read().decode()[-2000:]}")
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError(f"No response within {timeout}s")
+            try:
+                get(f"http://127.0.0.1:{port}/")
+                break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        report = json.loads(get(f"http://127.0.0.1:{port}/startup-stats"))
+        return elapsed, report
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true")
+    args = parser.parse_args()
+
+    times = []
+    report = None
+    for _ in range(max(1, args.repeat)):
+        elapsed, report = cold_start(args.warmup)
+        times.append(elapsed)
+
+    print(f"Runs: {len(times)}{' (with background warmup)' if args.warmup else ''}")
+    print(f"Time to first response: median {statistics.median(times) * 1000:.0f} ms, "
+          f"min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms")
+    print(f"App ready after {report['ready_seconds'] * 1000:.0f} ms of imports (last run)")
+    for kind in ("imports", "clients"):
+        for name, entry in report[kind].items():
+            print(f"  {kind[:-1]:<6} {name:<32} {entry['seconds'] * 1000:8.1f} ms  {entry['phase']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Side-by-side check of the image pre-processing stage.
+
+Runs every image in a folder through Gemini twice, once as the original upload
+and once after ``service.image_preprocess``, and compares bytes sent, latency
+and the extracted fields. If ``<name>.json`` sits next to an image it is used
+as ground truth, otherwise the original-image extraction is the reference.
+
+    python -m benchmarks.image_preprocess samples/receipts
+"""
+import argparse
+import json
+import os
+import time
+from dotenv import load_dotenv
+from service.invoice_categorization import extract_invoices_from_files
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(",", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def score(result, expected):
+    """Fraction of the key fields that match the reference extraction."""
+    checks = [
+        str(result.get("biller_name", "")).strip().lower()
+        == str(expected.get("biller_name", "")).strip().lower(),
+        str(result.get("billing_date", "")) == str(expected.get("billing_date", "")),
+    ]
+    total, expected_total = _to_float(result.get("total")), _to_float(expected.get("total"))
+    checks.append(total is not None and expected_total is not None
+                  and abs(total - expected_total) < 0.01)
+    checks.append(len(result.get("items") or {}) == len(expected.get("items") or {}))
+    return sum(checks) / len(checks)
+
+
+def run(api_key, path, preprocess):
+    with open(path, "rb") as f:
+        started = time.perf_counter()
+        result = extract_invoices_from_files(
+            api_key, [(f, os.path.basename(path))], use_cache=False, preprocess=preprocess
+        )[0]
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder", help="folder with sample receipt images")
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    api_key = os.environ["GEMINI_API_KEY"]
+
+    rows = []
+    for name in sorted(os.listdir(args.folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(args.folder, name)
+        original, original_s = run(api_key, path, preprocess=False)
+        processed, processed_s = run(api_key, path, preprocess=True)
+
+        truth_path = os.path.splitext(path)[0] + ".json"
+        if os.path.exists(truth_path):
+            with open(truth_path) as f:
+                expected = json.load(f)
+        else:
+            expected = original
+
+        report = processed.get("preprocess", {})
+        rows.append({
+            "file": name,
+            "original_bytes": os.path.getsize(path),
+            "processed_bytes": report.get("processed_bytes"),
+            "original_s": round(original_s, 2),
+            "processed_s": round(processed_s, 2),
+            "original_score": score(original, expected),
+            "processed_score": score(processed, expected),
+        })
+        print(json.dumps(rows[-1]))
+
+    if rows:
+        n = len(rows)
+        print("\n--- Summary ---")
+        print(f"Files: {n}")
+        print(f"Bytes sent: {sum(r['original_bytes'] for r in rows)} -> "
+              f"{sum(r['processed_bytes'] or 0 for r in rows)}")
+        print(f"Mean latency: {sum(r['original_s'] for r in rows) / n:.2f}s -> "
+              f"{sum(r['processed_s'] for r in rows) / n:.2f}s")
+        print(f"Mean field accuracy: {sum(r['original_score'] for r in rows) / n:.2%} -> "
+              f"{sum(r['processed_score'] for r in rows) / n:.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compare the dict-per-receipt path with the columnar receipt snapshot.
+
+Builds synthetic receipts in memory (no Firestore) and measures, for both
+representations, the memory they hold and the time to answer a typical
+dashboard query: receipts of one category in a date range, grouped by
+biller, plus a newest-first page of 50.
+
+    python -m benchmarks.receipt_columns --count 100000 [--repeat 5]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from service.receipt import normalize_receipt
+from service.receipt_columns import ReceiptColumns
+
+CATEGORIES = ["grocery", "food", "utility", "rent", "travel", "health"]
+
+
+def make_receipts(count):
+    start = datetime(2020, 1, 1)
+    return [
+        {
+            "id": f"{i:012x}",
+            "biller_name": f"Store {i % 500}",
+            "bill_value": str(round(5 + (i * 7919) % 10000 / 100, 2)),
+            "date": start + timedelta(minutes=i * 37),
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "items": [{"item": f"item {j}", "price": str(1 + j)} for j in range(3)],
+        }
+        for i in range(count)
+    ]
+
+
+def measure(build):
+    """(result, bytes retained, seconds) of ``build()``."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, elapsed
+
+
+def dict_query(receipts, start, end, category):
+    """What a client does today with /receipt/get-all."""
+    rows = [normalize_receipt(r) for r in receipts]
+    selected = [r for r in rows if r["category"] == category and start <= r["date"] < end]
+    by_biller = {}
+    for r in selected:
+        by_biller[r["biller_name"]] = by_biller.get(r["biller_name"], 0.0) + float(r["bill_value"])
+    page = sorted(rows, key=lambda r: (r["date"], r["id"]), reverse=True)[:50]
+    return by_biller, page
+
+
+def columnar_query(columns, start, end, category):
+    rows = columns.select(start=start, end=end, category=category)
+    by_biller = columns.group_by("biller", rows)
+    page = [normalize_receipt(columns.receipt(i)) for i in columns.order(list(range(len(columns))))[:50]]
+    return by_biller, page
+
+
+def best_of(repeat, fn, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    receipts = make_receipts(args.count)
+    start, end, category = "2021-01-01", "2021-12-31", "grocery"
+
+    normalized, dict_bytes, dict_build_s = measure(lambda: [normalize_receipt(r) for r in receipts])
+    del normalized
+    columns, column_bytes, column_build_s = measure(lambda: ReceiptColumns(receipts))
+
+    dict_result, dict_s = best_of(
+        args.repeat, dict_query, receipts, start + "T00:00:00", "2022-01-01T00:00:00", category)
+    column_result, column_s = best_of(args.repeat, columnar_query, columns, start, end, category)
+    column_totals = {b["label"]: b["total"] for b in column_result[0].values()}
+    same = all(abs(column_totals.get(name, 0) - total) < 1e-6 for name, total in dict_result[0].items())
+
+    print(f"Receipts: {args.count}")
+    print(f"Dict per receipt: {dict_bytes / 1e6:.1f} MB, build {dict_build_s:.2f}s, "
+          f"query {dict_s * 1000:.1f} ms")
+    print(f"Columnar:         {column_bytes / 1e6:.1f} MB, build {column_build_s:.2f}s, "
+          f"query {column_s * 1000:.1f} ms")
+    print(f"Query speed-up: {dict_s / column_s:.1f}x, same totals: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,39 @@
-from flask import Blueprint, jsonify, request
+import io
+import json
+import threading
+import time
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
-from google.cloud import firestore
 import os
 from service.receipt import getAllReceipts, getReceiptById, addReceipt, update_receipt
-from service.invoice_categorization import extract_invoices_from_files
-from dotenv import load_dotenv
+from service.invoice_categorization import (
+    FAST_MODEL_NAME, extract_invoices_from_files, iter_invoices_from_files
+)
+from service.extraction_cache import extraction_cache
+from service.extraction_metrics import extraction_metrics
+from service.extraction_jobs import ExtractionJobQueue, JobQueueFull
+from service.gemini_client import get_gemini_client
+
+intelligent_blueprint = Blueprint("intelligent", __name__)
 
-load_dotenv(override=True)
+_extraction_jobs = None
+_extraction_jobs_lock = threading.Lock()
 
-GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
 
-intelligent_blueprint = Blueprint("intelligent", __name__)
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "service-account.json"
-db = firestore.Client()
-collection_name = 'receipt'
-api_key = GEMINI_API_KEY
+def get_api_key():
+    """``GEMINI_API_KEY``, read when a request first needs it (app.py loads .env)."""
+    return os.environ["GEMINI_API_KEY"]
+
+
+def get_extraction_jobs():
+    """The shared ``ExtractionJobQueue``; its job store is opened on first use."""
+    global _extraction_jobs
+    if _extraction_jobs is None:
+        with _extraction_jobs_lock:
+            if _extraction_jobs is None:
+                _extraction_jobs = ExtractionJobQueue(get_api_key())
+    return _extraction_jobs
 
 
 CORS(
@@ -25,6 +43,32 @@ CORS(
 )
 
 
+def wants_stream():
+    """Streaming is opt-in: ?stream=1 or Accept: application/x-ndjson."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+
+def stream_invoices(file_list):
+    """One JSON line per file as soon as it is parsed, then a summary line."""
+    started = time.perf_counter()
+    errors = 0
+    try:
+        for index, invoice_info in iter_invoices_from_files(get_api_key(), file_list):
+            if 'error' in invoice_info:
+                errors += 1
+            yield json.dumps({'type': 'invoice', 'index': index, **invoice_info}) + '\n'
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    yield json.dumps({
+        'type': 'summary',
+        'files': len(file_list),
+        'errors': errors,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }) + '\n'
+
+
 @intelligent_blueprint.route('/categorize-receipts', methods=['POST'])
 def categorize_receipt():
     try:
@@ -32,7 +76,15 @@ def categorize_receipt():
         if not files:
             return jsonify({'error': 'No files provided'}), 400
         file_list = [(file, file.filename) for file in files]
-        result = extract_invoices_from_files(api_key, file_list)
+        if wants_stream():
+            # The body is produced after this view returns, when Werkzeug has
+            # already closed the uploads: hand the generator copies
+            buffered = [(io.BytesIO(file.read()), filename) for file, filename in file_list]
+            return Response(
+                stream_with_context(stream_invoices(buffered)),
+                mimetype='application/x-ndjson'
+            )
+        result = extract_invoices_from_files(get_api_key(), file_list)
         return jsonify(result), 200
     except BadRequest as e:
         raise BadRequest(str(e))
@@ -40,6 +92,66 @@ def categorize_receipt():
         return jsonify({'error': str(e)}), 500
 
 
+@intelligent_blueprint.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(extraction_cache.stats()), 200
+
+
+@intelligent_blueprint.route('/gemini-stats', methods=['GET'])
+def gemini_stats():
+    return jsonify(get_gemini_client().stats()), 200
+
+
+@intelligent_blueprint.route('/extraction-stats', methods=['GET'])
+def extraction_stats():
+    return jsonify(extraction_metrics.stats(first_tier=FAST_MODEL_NAME)), 200
+
+
+@intelligent_blueprint.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+        job = get_extraction_jobs().submit([(file, file.filename) for file in files])
+        return jsonify({'id': job['id'], 'status': job['status'], 'total': job['total']}), 202
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '30'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@intelligent_blueprint.route('/jobs/<string:job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_extraction_jobs().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'id': job['id'],
+        'status': job['status'],
+        'completed': job['completed'],
+        'total': job['total'],
+        'error': job['error'],
+        'partial_results': [r for r in job['results'] if r is not None],
+    }), 200
+
+
+@intelligent_blueprint.route('/jobs/<string:job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_extraction_jobs().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] in ('queued', 'running'):
+        return jsonify({'error': 'Job not finished', 'status': job['status']}), 409
+    if job['status'] == 'rejected':
+        # Turned away by a full queue, nothing failed; submit it again
+        return jsonify({'error': 'Job was rejected, the extraction queue was full',
+                        'status': job['status']}), 429, {'Retry-After': '30'}
+    if job['status'] != 'done':
+        return jsonify({'error': job['error'] or 'Job failed', 'status': job['status']}), 500
+    return jsonify(job['results']), 200
+
+
 # @intelligent_blueprint.route('/xx', methods=['POST'])
 # def categorize_receipt():
 #     try:
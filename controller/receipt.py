@@ -1,15 +1,11 @@
-from flask import Blueprint, jsonify,Flask, request
+from flask import Blueprint, jsonify,Flask, request, Response
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
-from google.cloud import firestore
-import os
-from service.receipt import getAllReceipts,getReceiptById, addReceipt,update_receipt
+from service.receipt import getAllReceipts,getReceiptById, addReceipt,update_receipt, parse_fields, receipt_cache, addReceiptsBulk, getSummary, parse_filters, queryReceipts, searchReceipts, getChanges, get_sync_state, list_validators, is_not_modified, validator_headers
 from service.invoice_categorization import extract_invoices_from_files
+from service.receipt_search import SearchIndexNotBuilt
 
 receipt_blueprint = Blueprint("receipt", __name__)
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "service-account.json"
-db = firestore.Client()
-collection_name = 'receipt'
 
 CORS(
     receipt_blueprint,
@@ -26,15 +22,77 @@ def add_item():
         return jsonify({'error': str(e)}), 500
 
 
+@receipt_blueprint.route('/add-receipts/bulk', methods=['POST'])
+def add_items_bulk():
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get('receipts')
+    try:
+        return addReceiptsBulk(data), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @receipt_blueprint.route("/get-all", methods=["GET"])
 def get_all():
     try:
-        return getAllReceipts(),200
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        fields = parse_fields(request.args.get('fields'))
+        filters = parse_filters(request.args)
+        since = request.args.get('since')
+        if since and (filters or limit or request.args.get('sort') or request.args.get('start_after')):
+            return jsonify({'error': 'since cannot be combined with filters, sort or paging'}), 400
+
+        state = get_sync_state()
+        etag, last_modified = list_validators(state, request.args)
+        headers = validator_headers(etag, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return Response(status=304, headers=headers)
+        if since:
+            return getChanges(since, fields, headers)
+        if filters or request.args.get('sort'):
+            return queryReceipts(filters, request.args.get('sort'), limit,
+                                 request.args.get('start_after'), fields, state['version'], headers)
+        return getAllReceipts(limit, request.args.get('start_after'), fields, state['version'], headers)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except BadRequest as e:
         raise BadRequest(str(e))
     except Exception as e:
         raise BadRequest("An error occurred during registration: " + str(e))
 
+@receipt_blueprint.route("/summary", methods=["GET"])
+def summary():
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    try:
+        return getSummary(request.args.get('dimension'), limit, parse_filters(request.args)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@receipt_blueprint.route("/search", methods=["GET"])
+def search():
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer'}), 400
+    try:
+        return searchReceipts(request.args.get('q', ''), limit, parse_filters(request.args)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except SearchIndexNotBuilt as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@receipt_blueprint.route("/cache-stats", methods=["GET"])
+def cache_stats():
+    return jsonify(receipt_cache.stats()), 200
+
 @receipt_blueprint.route("/get-by-id/<string:custom_id>", methods=["GET"])
 def get_by_id(custom_id):
     try:
@@ -1,17 +1,22 @@
 
 
 import os
-import time
-import email
-import fitz  # PyMuPDF
 import json
+import hashlib
 import google.generativeai as genai
-from imapclient import IMAPClient
+from imapclient import SEEN
+from jobs.mailbox import MailboxWatcher
+from jobs.mail_fetch import envelope_summary, fetch_attachments
+from jobs.pipeline import Pipeline, Stage
+import threading
+import time
 from dotenv import load_dotenv
-from google.cloud import firestore
-from datetime import datetime
 import os
 from uuid import uuid4
+from service.receipt import parse_receipt_date, store_receipt
+from service.invoice_classifier import classify_pdf
+from service.invoice_schema import generate_invoice
+from service.receipt_dedup import RECEIPT_DEDUP, find_attachment
 
 load_dotenv(override=True)
 
@@ -21,31 +26,129 @@ MAIL_USERNAME = os.getenv("MAIL_USERNAME")
 MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "service-account.json"
 
+MAIL_PIPELINE_QUEUE_SIZE = int(os.getenv("MAIL_PIPELINE_QUEUE_SIZE", 20))
+MAIL_CLASSIFY_WORKERS = int(os.getenv("MAIL_CLASSIFY_WORKERS", 2))
+MAIL_EXTRACT_WORKERS = int(os.getenv("MAIL_EXTRACT_WORKERS", 4))
+MAIL_PERSIST_WORKERS = int(os.getenv("MAIL_PERSIST_WORKERS", 2))
+MAIL_PIPELINE_REPORT_SECONDS = int(os.getenv("MAIL_PIPELINE_REPORT_SECONDS", 60))
+# A message with a failed attachment stays unread and is retried after this long
+MAIL_RETRY_SECONDS = int(os.getenv("MAIL_RETRY_SECONDS", 600))
+# After this many failed attempts a message is flagged \Seen and MAIL_FAILED_KEYWORD
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 3))
+MAIL_FAILED_KEYWORD = os.getenv("MAIL_FAILED_KEYWORD", "$InvoiceFailed")
+
+
+def add_to_receipt_collection(invoice_dict, attachment_hash=None):
+    """Add parsed invoice to Firestore collection.
 
-def add_to_receipt_collection(invoice_dict):
-    """Add parsed invoice to Firestore collection."""
-    db = firestore.Client()
-    collection_name = 'receipt'
+    A bill already stored (e.g. uploaded by hand) is not written again.
+    """
     try:
-        # Convert date string to Firestore Timestamp
-        date = invoice_dict['billing_date']
+        # Convert date string to Firestore Timestamp (None if the model found none)
+        date = parse_receipt_date(invoice_dict.get('billing_date'))
         print(f"before: {invoice_dict['items']}")
 
         invoice_dict["items"] = [{'item': k, 'price': v}
                                  for k, v in invoice_dict['items'].items()]
         print(f"after: {invoice_dict['items']}")
         # Create document
+        receipt_id = uuid4().hex
         obj = {
-            'id': uuid4().hex,
+            'id': receipt_id,
             'date': date,
             'items': invoice_dict['items'],
             "bill_value": invoice_dict["total"],
             "biller_name": invoice_dict["biller_name"],
         }
+        if invoice_dict.get("category"):
+            obj["category"] = invoice_dict["category"]
 
-        doc_ref = db.collection(collection_name).add(obj)
+        receipt_id, duplicate = store_receipt(obj, attachment_hash)
+        if duplicate:
+            print(f"♻️ Duplicate of receipt {receipt_id} ({duplicate})")
+        return True
     except Exception as e:
         print(f"Error adding document: {str(e)}")
+        return False
+
+
+class MessageTracker:
+    """Counts outstanding attachments per message.
+
+    A message becomes ready to be flagged \\Seen once every one of its
+    attachments has been persisted or classified as not-an-invoice. If any
+    attachment failed the message stays unread, so it still shows up in the
+    mail client and in the watcher's UNSEEN scan, which hands it over again
+    on the first fetch after ``retry_seconds``. After ``max_attempts``
+    failed attempts the message is given up on instead: it is drained by
+    ``drain_failed`` to be flagged \\Seen with a keyword, so it is not sent
+    to the model again. Attempts are counted in memory, a restart starts
+    the count over.
+    """
+
+    def __init__(self, retry_seconds=MAIL_RETRY_SECONDS, max_attempts=MAIL_MAX_ATTEMPTS):
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self._pending = {}
+        self._failed = set()
+        self._attempts = {}
+        self._retry_at = {}
+        self._ready = []
+        self._given_up = []
+        self._lock = threading.Lock()
+
+    def register(self, uid, count):
+        with self._lock:
+            self._retry_at.pop(uid, None)
+            if count:
+                self._pending[uid] = count
+            else:
+                self._ready.append(uid)
+
+    def done(self, uid, ok=True):
+        with self._lock:
+            if not ok:
+                self._failed.add(uid)
+            self._pending[uid] -= 1
+            if self._pending[uid] == 0:
+                del self._pending[uid]
+                if uid in self._failed:
+                    self._failed.discard(uid)
+                    attempts = self._attempts.get(uid, 0) + 1
+                    if attempts >= self.max_attempts:
+                        self._attempts.pop(uid, None)
+                        self._given_up.append(uid)
+                        print(f"🛑 Message {uid} failed {attempts} times, giving up")
+                    else:
+                        self._attempts[uid] = attempts
+                        self._retry_at[uid] = time.monotonic() + self.retry_seconds
+                        print(f"⚠️ Message {uid} left unread, an attachment failed; "
+                              f"retrying in {self.retry_seconds}s")
+                else:
+                    self._attempts.pop(uid, None)
+                    self._ready.append(uid)
+
+    def drain(self):
+        with self._lock:
+            ready, self._ready = self._ready, []
+            return ready
+
+    def drain_failed(self):
+        """Messages that failed ``max_attempts`` times, to be flagged as given up."""
+        with self._lock:
+            given_up, self._given_up = self._given_up, []
+            return given_up
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._pending)
+
+    def busy(self):
+        """UIDs not to hand over again: in flight, awaiting the flag, or failed recently."""
+        now = time.monotonic()
+        with self._lock:
+            self._retry_at = {uid: at for uid, at in self._retry_at.items() if at > now}
+            return set(self._pending) | set(self._ready) | set(self._given_up) | set(self._retry_at)
 
 
 def process_invoice_emails():
@@ -63,93 +166,124 @@ From the invoice image, extract the following details in JSON format:
   "biller_name": "<name of the person/shop/organization or entity billed>",
   "billing_date": "<date of the bill in YYYY-MM-DD format if available>",
   "category": "<automatically determined category, such as grocery, rent, utility, food, etc.>",
-  "items": {
-    "<item name>": <price>
-  },
+  "items": [
+    {"item": "<item name>", "price": <price>}
+  ],
   "total": <total amount>
 }
 ```"""
 
-    while True:
-        print("Checking for new emails...")
-        try:
-            with IMAPClient(MAIL_HOST, port=MAIL_PORT) as client:
-                client.login(MAIL_USERNAME, MAIL_PASSWORD)
-                client.select_folder('INBOX')
-                messages = client.search(['UNSEEN'])
-
-                for message_id, data in client.fetch(messages, ['RFC822']).items():
-                    message = email.message_from_bytes(data[b'RFC822'])
-                    from_ = message['From']
-                    subject = message['Subject']
-                    date = message['Date']
-                    attachments_processed = []
-
-                    if message.is_multipart():
-                        for part in message.walk():
-                            content_disposition = str(
-                                part.get("Content-Disposition"))
-                            if "attachment" in content_disposition:
-                                filename = part.get_filename()
-                                if filename and filename.lower().endswith(".pdf"):
-                                    payload = part.get_payload(decode=True)
-
-                                    try:
-                                        with fitz.open(stream=payload, filetype="pdf") as doc:
-                                            full_text = "\n".join(
-                                                [page.get_text() for page in doc]).lower()
-                                            if "invoice" in full_text or "bill" in full_text:
-                                                # Process PDF with Gemini
-                                                gemini_input = [
-                                                    prompt, {"mime_type": "application/pdf", "data": payload}]
-                                                response = model.generate_content(
-                                                    gemini_input)
-                                                json_str = response.text.strip(
-                                                    "```json").strip("```").strip()
-                                                invoice_dict = json.loads(
-                                                    json_str)
-
-                                                # Convert items list to dict
-                                                if isinstance(invoice_dict.get("items"), list):
-                                                    items_dict = {}
-                                                    for entry in invoice_dict["items"]:
-                                                        key = entry.get(
-                                                            "item", "").strip().replace("\n", " ")
-                                                        value = float(
-                                                            entry.get("price", 0))
-                                                        items_dict[key] = value
-                                                    invoice_dict["items"] = items_dict
-
-                                                print(
-                                                    "\n🧾 Parsed Invoice Dictionary:")
-                                                print(json.dumps(
-                                                    invoice_dict, indent=2))
-                                                attachments_processed.append(
-                                                    filename)
-                                                add_to_receipt_collection(
-                                                    invoice_dict)
-
-                                    except Exception as e:
-                                        print(
-                                            f"❌ Error processing PDF {filename}: {e}")
-
-                    print("\n--- New Email ---")
-                    print(f"From: {from_}")
-                    print(f"Date: {date}")
-                    print(f"Subject: {subject}")
-                    if attachments_processed:
-                        print("✅ Processed Attachments:")
-                        for att in attachments_processed:
-                            print(f"- {att}")
-                    else:
-                        print("📭 No invoice-related PDF attachments found.")
+    def is_pdf_attachment(part):
+        return part["mime_type"] == "application/pdf" or \
+            (part["filename"] or "").lower().endswith(".pdf")
+
+    tracker = MessageTracker()
+
+    # fetch (IMAP thread) -> classify -> extract -> persist, each stage with
+    # its own workers and a bounded queue in front of it
+    def classify(item):
+        # Same file seen before (by mail or upload): no need to parse it again
+        item["content_hash"] = hashlib.sha256(item["payload"]).hexdigest()
+        duplicate_of = find_attachment(item["content_hash"]) if RECEIPT_DEDUP else None
+        if duplicate_of:
+            print(f"♻️ {item['filename']} is already receipt {duplicate_of}, skipping")
+            tracker.done(item["uid"])
+            return None
+
+        # Stops reading pages at the first confident hit
+        classification = classify_pdf(item["payload"])
+        if classification["is_invoice"]:
+            return [item]
+        print(f"📭 {item['filename']} does not look like an invoice "
+              f"(score {classification['score']})")
+        tracker.done(item["uid"])
+        return None
+
+    def extract(item):
+        # Process PDF with Gemini
+        gemini_input = [
+            prompt, {"mime_type": "application/pdf", "data": item["payload"]}]
+        # JSON mode against the shared invoice schema, one repair re-prompt
+        invoice, _ = generate_invoice(model, gemini_input, item["filename"])
+        if invoice is None:
+            raise ValueError("model output did not match the invoice schema")
+        invoice_dict = dict(invoice)
+
+        # Convert items list to dict
+        if isinstance(invoice_dict.get("items"), list):
+            items_dict = {}
+            for entry in invoice_dict["items"]:
+                key = entry.get(
+                    "item", "").strip().replace("\n", " ")
+                value = float(
+                    entry.get("price", 0))
+                items_dict[key] = value
+            invoice_dict["items"] = items_dict
+
+        print(
+            "\n🧾 Parsed Invoice Dictionary:")
+        print(json.dumps(
+            invoice_dict, indent=2))
+        return [{**item, "payload": None, "invoice": invoice_dict}]
+
+    def persist(item):
+        ok = add_to_receipt_collection(item["invoice"], item["content_hash"])
+        if ok:
+            print(f"✅ Processed attachment {item['filename']} (message {item['uid']})")
+        tracker.done(item["uid"], ok)
+        watcher.wakeup.set()
+
+    def on_error(stage_name, item, error):
+        print(f"❌ Error processing PDF {item['filename']} in {stage_name}: {error}")
+        tracker.done(item["uid"], ok=False)
+        watcher.wakeup.set()
+
+    pipeline = Pipeline([
+        Stage("classify", classify, MAIL_CLASSIFY_WORKERS, MAIL_PIPELINE_QUEUE_SIZE),
+        Stage("extract", extract, MAIL_EXTRACT_WORKERS, MAIL_PIPELINE_QUEUE_SIZE),
+        Stage("persist", persist, MAIL_PERSIST_WORKERS, MAIL_PIPELINE_QUEUE_SIZE),
+    ], on_error=on_error)
+
+    def fetch(client, uids):
+        # Only PDF parts are downloaded; other mail costs just its structure
+        for message_id, envelope, attachments in fetch_attachments(
+                client, uids, select=is_pdf_attachment):
+            summary = envelope_summary(envelope)
+            print("\n--- New Email ---")
+            print(f"From: {summary['from']}")
+            print(f"Date: {summary['date']}")
+            print(f"Subject: {summary['subject']}")
+            if not attachments:
+                print("📭 No invoice-related PDF attachments found.")
+
+            tracker.register(message_id, len(attachments))
+            for part, payload in attachments:
+                # Blocks while the classify queue is full
+                pipeline.put({"uid": message_id, "filename": part["filename"], "payload": payload})
 
-        except Exception as e:
-            print(f"🛑 Error: {e}")
-            time.sleep(10)
-            continue
+    def mark_seen(client):
+        # Runs on the IMAP thread: flag messages whose attachments are all
+        # persisted (or were not invoices)
+        ready = tracker.drain()
+        if ready:
+            client.add_flags(ready, [SEEN])
+        # Out of the UNSEEN scan for good; the keyword lets them be found
+        # and re-queued by clearing \Seen
+        given_up = tracker.drain_failed()
+        if given_up:
+            client.add_flags(given_up, [SEEN])
+            try:
+                client.add_flags(given_up, [MAIL_FAILED_KEYWORD])
+            except Exception as e:
+                # Not every server allows custom keywords
+                print(f"⚠️ Could not flag {given_up} with {MAIL_FAILED_KEYWORD}: {e}")
 
-        time.sleep(60)
+    watcher = MailboxWatcher(
+        'invoices', MAIL_HOST, MAIL_PORT, MAIL_USERNAME, MAIL_PASSWORD, fetch, on_cycle=mark_seen,
+        busy=tracker.busy
+    )
+    pipeline.start(report_every=MAIL_PIPELINE_REPORT_SECONDS)
+    watcher.run_forever()
 
 
 # Run the function
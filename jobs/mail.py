@@ -1,10 +1,10 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from pathlib import Path
-from imapclient import IMAPClient
+from imapclient import SEEN
+from jobs.mailbox import MailboxWatcher
+from jobs.mail_fetch import envelope_summary, fetch_attachments
 from dotenv import load_dotenv
 
-import email
-
 import os
 
 load_dotenv(override=True)
@@ -30,67 +30,49 @@ def save_attachment(attachment, from_email, msg_id, filename):
         f.write(attachment)
 
 
+def save_messages(client, uids):
+    """Save the PDF/image attachments of new messages.
+
+    Only BODYSTRUCTURE/ENVELOPE is fetched for every message; attachment
+    parts are then downloaded on their own, so newsletters and other mail
+    without invoices cost a few hundred bytes each.
+    """
+    for message_id, envelope, attachments in fetch_attachments(client, uids):
+        summary = envelope_summary(envelope)
+        saved = []
+        for part, payload in attachments:
+            save_attachment(payload, summary["from"] or "unknown", message_id,
+                            os.path.basename(part["filename"]))
+            saved.append(part["filename"])
+
+        # Print email details
+        print("\n--- New Email ---")
+        print(f"From: {summary['from']}")
+        print(f"Date: {summary['date']}")
+        print(f"Subject: {summary['subject']}")
+        if saved:
+            print("Attachments saved:")
+            for att in saved:
+                print(f"- {att}")
+
+    # PEEK fetches leave messages unread; keep the old "fetched means seen"
+    client.add_flags(uids, [SEEN])
+
+
 def listen_for_emails():
-    while True:
-        print("Checking for new emails...")
-        try:
-            with IMAPClient(MAIL_HOST, port=MAIL_PORT) as client:
-                client.login(MAIL_USERNAME, MAIL_PASSWORD)
-                client.select_folder('INBOX')
-                # Search for unseen messages
-                messages = client.search(['UNSEEN'])
-                for message_id, data in client.fetch(messages, ['RFC822', 'BODY[TEXT]']).items():
-                    # Parse email message
-                    message = email.message_from_bytes(data[b'RFC822'])
-
-                    # Get email details
-                    from_ = message['From']
-                    subject = message['Subject']
-                    date = message['Date']
-
-                    # Get body text and handle attachments
-                    body = ""
-                    attachments = []
-                    if message.is_multipart():
-                        for part in message.walk():
-                            content_type = part.get_content_type()
-                            content_disposition = str(
-                                part.get("Content-Disposition"))
-
-                            if "attachment" in content_disposition:
-                                filename = part.get_filename()
-                                if filename:
-                                    payload = part.get_payload(decode=True)
-                                    save_attachment(
-                                        payload, from_, message_id, filename)
-                                    attachments.append(filename)
-                            elif content_type == 'text/plain':
-                                body = part.get_payload(
-                                    decode=True).decode('utf-8')
-                    else:
-                        body = message.get_payload(decode=True).decode('utf-8')
-
-                    # Print email details
-                    print("\n--- New Email ---")
-                    print(f"From: {from_}")
-                    print(f"Date: {date}")
-                    print(f"Subject: {subject}")
-                    print(f"Body:\n{body}\n")
-                    if attachments:
-                        print("Attachments saved:")
-                        for att in attachments:
-                            print(f"- {att}")
-
-        except Exception as e:
-            print(f"Error: {e}")
-            continue
+    """Watch the inbox over one long-lived IMAP IDLE connection."""
+    MailboxWatcher(
+        'attachments', MAIL_HOST, MAIL_PORT, MAIL_USERNAME, MAIL_PASSWORD, save_messages
+    ).run_forever()
 
 
 sched = BackgroundScheduler()
 
 
-sched.add_job(listen_for_emails, 'interval', minutes=.3,
-              id='email_listener', replace_existing=True)
+# Runs once and never returns: the watcher keeps its own connection alive,
+# so there are no overlapping interval runs re-logging in.
+sched.add_job(listen_for_emails, id='email_listener', replace_existing=True,
+              max_instances=1)
 
 
 def start_scheduler():
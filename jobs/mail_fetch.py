@@ -0,0 +1,187 @@
+import base64
+import itertools
+import os
+import quopri
+from urllib.parse import unquote
+from email.header import decode_header, make_header
+
+MAIL_FETCH_BATCH_SIZE = int(os.getenv("MAIL_FETCH_BATCH_SIZE", 50))
+
+INVOICE_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _text(value):
+    """Decode an IMAP string (bytes, possibly RFC 2047 encoded) to str."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def _params(raw):
+    """Turn a flat (key, value, key, value, ...) tuple into a lowercase dict."""
+    if not raw or not isinstance(raw, (tuple, list)):
+        return {}
+    params = {}
+    for key, value in zip(raw[::2], raw[1::2]):
+        key = _text(key).lower()
+        value = _text(value)
+        if key.endswith("*") and value and "''" in value:
+            # RFC 2231: charset'lang'value
+            key, value = key[:-1], unquote(value.split("''", 1)[1])
+        params[key] = value
+    return params
+
+
+def _disposition(part):
+    """Pull the Content-Disposition out of a single-part BODYSTRUCTURE."""
+    main_type = _text(part[0]).lower()
+    sub_type = _text(part[1]).lower()
+    if main_type == "text":
+        index = 9
+    elif main_type == "message" and sub_type == "rfc822":
+        index = 11
+    else:
+        index = 8
+    if len(part) > index and isinstance(part[index], (tuple, list)) and part[index]:
+        return _text(part[index][0]).lower(), _params(part[index][1])
+    return None, {}
+
+
+def _children(structure):
+    """Child parts of a multipart BODYSTRUCTURE, or None for a single part.
+
+    imapclient wraps the top level in ``BodyData`` (children in a list at
+    index 0); a body nested in a message/rfc822 part arrives as plain
+    tuples, with the children as the leading tuple elements.
+    """
+    if isinstance(structure[0], list):
+        return structure[0]
+    if isinstance(structure[0], tuple):
+        return list(itertools.takewhile(lambda child: isinstance(child, tuple), structure))
+    return None
+
+
+def walk_bodystructure(structure, prefix=""):
+    """Yield a description of every leaf part with its IMAP section number.
+
+    Forwarded messages (message/rfc822 parts) are yielded and then walked
+    into, so an invoice attached to a forwarded mail gets a section like
+    ``2.1`` or ``2.2``.
+    """
+    children = _children(structure)
+    if children is not None:
+        for i, child in enumerate(children, start=1):
+            yield from walk_bodystructure(child, f"{prefix}{i}.")
+        return
+
+    section = prefix.rstrip(".") or "1"
+    disposition, disposition_params = _disposition(structure)
+    params = _params(structure[2])
+    mime_type = f"{_text(structure[0])}/{_text(structure[1])}".lower()
+    yield {
+        "section": section,
+        "mime_type": mime_type,
+        "filename": disposition_params.get("filename") or params.get("name"),
+        "disposition": disposition,
+        "encoding": (_text(structure[5]) or "7bit").lower(),
+        "size": structure[6],
+    }
+
+    if mime_type == "message/rfc822" and len(structure) > 8 and isinstance(structure[8], (tuple, list)):
+        body = structure[8]
+        # The parts of a multipart body are <section>.1, <section>.2, ...; a
+        # single-part body is <section>.1 itself
+        nested_prefix = f"{section}." if _children(body) is not None else f"{section}.1."
+        yield from walk_bodystructure(body, nested_prefix)
+
+
+def is_invoice_attachment(part, extensions=(".pdf",) + INVOICE_IMAGE_EXTENSIONS):
+    """PDF or image parts that carry a filename (inline or attachment)."""
+    filename = (part["filename"] or "").lower()
+    if not filename:
+        return False
+    if part["mime_type"] == "application/pdf" or part["mime_type"].startswith("image/"):
+        return True
+    # Plenty of mailers send PDFs as application/octet-stream
+    return filename.endswith(extensions)
+
+
+def envelope_summary(envelope):
+    """From, subject and date of an IMAP ENVELOPE as plain strings."""
+    sender = None
+    if envelope.from_:
+        address = envelope.from_[0]
+        mailbox = f"{_text(address.mailbox)}@{_text(address.host)}"
+        sender = f"{_text(address.name)} <{mailbox}>" if address.name else mailbox
+    return {
+        "from": sender,
+        "subject": _text(envelope.subject),
+        "date": envelope.date.isoformat() if envelope.date else None,
+    }
+
+
+def fetch_structures(client, uids, batch_size=MAIL_FETCH_BATCH_SIZE):
+    """Step 1: ``{uid: (envelope, [parts])}`` without downloading any body."""
+    structures = {}
+    for batch in _chunks(list(uids), batch_size):
+        for uid, data in client.fetch(batch, ['BODYSTRUCTURE', 'ENVELOPE']).items():
+            structures[uid] = (data[b'ENVELOPE'], list(walk_bodystructure(data[b'BODYSTRUCTURE'])))
+    return structures
+
+
+def decode_part(raw, encoding):
+    if encoding == "base64":
+        return base64.b64decode(raw)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(raw)
+    return raw
+
+
+def fetch_parts(client, wanted, batch_size=MAIL_FETCH_BATCH_SIZE):
+    """Step 3: download only the selected parts with ``BODY.PEEK[section]``.
+
+    ``wanted`` maps uid -> list of parts (from ``fetch_structures``). Messages
+    that need the same sections are fetched together, ``batch_size`` at a
+    time. Returns ``{uid: [(part, payload_bytes), ...]}``. PEEK leaves the
+    \\Seen flag alone.
+    """
+    groups = {}
+    for uid, parts in wanted.items():
+        if parts:
+            groups.setdefault(tuple(p["section"] for p in parts), []).append(uid)
+
+    payloads = {}
+    for sections, group_uids in groups.items():
+        items = [f"BODY.PEEK[{section}]" for section in sections]
+        for batch in _chunks(group_uids, batch_size):
+            for uid, data in client.fetch(batch, items).items():
+                payloads[uid] = [
+                    (part, decode_part(data[f"BODY[{part['section']}]".encode()], part["encoding"]))
+                    for part in wanted[uid]
+                ]
+    return payloads
+
+
+def fetch_attachments(client, uids, select=is_invoice_attachment, batch_size=MAIL_FETCH_BATCH_SIZE):
+    """Run all three steps; yields ``(uid, envelope, [(part, payload), ...])``.
+
+    Messages without a selected part are still yielded (with an empty list)
+    so callers can log or flag them, but nothing beyond their structure is
+    downloaded.
+    """
+    structures = fetch_structures(client, uids, batch_size)
+    wanted = {uid: [p for p in parts if select(p)] for uid, (_, parts) in structures.items()}
+    payloads = fetch_parts(client, wanted, batch_size)
+    for uid in uids:
+        if uid in structures:
+            yield uid, structures[uid][0], payloads.get(uid, [])
@@ -0,0 +1,164 @@
+import json
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from imapclient import IMAPClient
+
+MAIL_STATE_DIR = os.getenv("MAIL_STATE_DIR", ".mail_state")
+# Servers drop IDLE after 30 minutes; restart it a bit earlier
+IDLE_RENEW_SECONDS = int(os.getenv("MAIL_IDLE_RENEW_SECONDS", 25 * 60))
+IDLE_CHECK_SECONDS = int(os.getenv("MAIL_IDLE_CHECK_SECONDS", 30))
+# Used only when the server does not advertise IDLE
+POLL_SECONDS = int(os.getenv("MAIL_POLL_SECONDS", 30))
+BACKOFF_MAX_SECONDS = int(os.getenv("MAIL_BACKOFF_MAX_SECONDS", 300))
+
+
+class MailboxState:
+    """Last seen UID and UIDVALIDITY of one mailbox, persisted as JSON."""
+
+    def __init__(self, name, username, folder, state_dir=MAIL_STATE_DIR):
+        safe = "".join(c for c in f"{name}_{username}_{folder}" if c.isalnum() or c in ('@', '.', '_', '-'))
+        self.path = Path(state_dir) / f"{safe}.json"
+        self.uidvalidity = None
+        self.last_uid = None
+        if self.path.exists():
+            with open(self.path) as f:
+                data = json.load(f)
+            self.uidvalidity = data.get("uidvalidity")
+            self.last_uid = data.get("last_uid")
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"uidvalidity": self.uidvalidity, "last_uid": self.last_uid}, f)
+        os.replace(tmp_path, self.path)
+
+
+class MailboxWatcher:
+    """Keep one IMAP connection open and hand new messages to ``handler``.
+
+    ``handler(client, uids)`` is called with the UIDs that arrived since the
+    last run (on the very first run: the UNSEEN ones). New mail is detected
+    with IMAP IDLE, or a NOOP poll on the same connection when the server has
+    no IDLE. Dropped connections are re-established with exponential backoff
+    and jitter, and the last handled UID survives restarts as long as the
+    mailbox UIDVALIDITY does not change. ``name`` keeps the saved state of
+    different consumers of the same mailbox apart.
+
+    The connection is only ever used from the watcher thread; work that needs
+    it (e.g. flagging messages from other threads) goes through ``on_cycle``.
+
+    A handler that finishes messages asynchronously and flags them \\Seen
+    only once they are done passes ``busy``, a callable returning the UIDs it
+    is still working on (or does not want again yet). ``last_uid`` then only
+    says which messages were handed over, not that they are done: every
+    fetch also searches UNSEEN, so a message whose processing failed, or was
+    still queued when the process died, is handed over again.
+    """
+
+    def __init__(self, name, host, port, username, password, handler, folder='INBOX',
+                 state_dir=MAIL_STATE_DIR, on_cycle=None, busy=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.handler = handler
+        self.folder = folder
+        self.state = MailboxState(name, username, folder, state_dir)
+        # on_cycle(client) runs on the IMAP thread after every fetch; other
+        # threads set ``wakeup`` to get it called without waiting for new mail
+        self.on_cycle = on_cycle
+        self.busy = busy
+        self.wakeup = threading.Event()
+
+    def run_forever(self):
+        failures = 0
+        while True:
+            try:
+                with IMAPClient(self.host, port=self.port) as client:
+                    client.login(self.username, self.password)
+                    print(f"📬 Connected to {self.host} ({self.folder})")
+                    failures = 0
+                    self._watch(client)
+            except Exception as e:
+                failures += 1
+                delay = min(BACKOFF_MAX_SECONDS, 2 ** failures) * random.uniform(0.5, 1.0)
+                print(f"🛑 Mailbox error: {e}; reconnecting in {delay:.0f}s")
+                time.sleep(delay)
+
+    def _watch(self, client):
+        status = client.select_folder(self.folder)
+        uidvalidity = status.get(b'UIDVALIDITY')
+        if self.state.uidvalidity != uidvalidity:
+            # UIDs from another UIDVALIDITY mean nothing here; start over
+            if self.state.uidvalidity is not None:
+                print("⚠️ UIDVALIDITY changed, resetting mailbox state")
+            self.state.uidvalidity = uidvalidity
+            self.state.last_uid = None
+
+        self._fetch_new(client, status.get(b'UIDNEXT'))
+        self._cycle(client)
+        use_idle = client.has_capability('IDLE')
+        while True:
+            if use_idle:
+                self._idle(client)
+            else:
+                self.wakeup.wait(POLL_SECONDS)
+                client.noop()
+            # A UID SEARCH is cheap and also covers mail that landed between
+            # the last fetch and the start of IDLE
+            self._fetch_new(client)
+            self._cycle(client)
+
+    def _cycle(self, client):
+        self.wakeup.clear()
+        if self.on_cycle:
+            self.on_cycle(client)
+
+    def _idle(self, client):
+        client.idle()
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < IDLE_RENEW_SECONDS:
+                responses = client.idle_check(timeout=IDLE_CHECK_SECONDS)
+                if any(isinstance(r, tuple) and len(r) > 1 and r[1] == b'EXISTS' for r in responses):
+                    return True
+                if self.wakeup.is_set():
+                    return False
+            return False
+        finally:
+            client.idle_done()
+
+    def _fetch_new(self, client, uidnext=None):
+        if self.state.last_uid is None:
+            # Remember where the mailbox is, not just the unseen tail. Taken
+            # before the UNSEEN search so nothing arriving in between is skipped
+            if uidnext:
+                floor = uidnext - 1
+            else:
+                # No UIDNEXT in the SELECT response: the newest UID is the floor
+                floor = max(client.search(['ALL']) or [0])
+            uids = client.search(['UNSEEN'])
+        else:
+            # "n:*" always matches the newest message, even below n
+            uids = [uid for uid in client.search(['UID', f'{self.state.last_uid + 1}:*'])
+                    if uid > self.state.last_uid]
+            floor = self.state.last_uid
+            if self.busy is not None:
+                # Handed over earlier but never flagged: failed or lost in a restart
+                uids = set(uids) | set(client.search(['UNSEEN']))
+
+        if self.busy is not None:
+            uids = set(uids) - set(self.busy())
+
+        if uids:
+            # Raises before the state moves on, so a failed batch is retried
+            self.handler(client, sorted(uids))
+
+        newest = max(list(uids) + [floor])
+        if newest != self.state.last_uid:
+            self.state.last_uid = newest
+            self.state.save()
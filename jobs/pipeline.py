@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+
+
+class Stage:
+    """One step of a ``Pipeline``: a bounded input queue and worker threads.
+
+    ``handler(item)`` returns an iterable of items for the next stage (or
+    None). ``put`` blocks while the queue is full, which is what pushes back
+    on the stage in front of it.
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=100):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next = None
+        self.on_error = None
+        self.processed = 0
+        self.failed = 0
+        self._threads = []
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                for output in self.handler(item) or ():
+                    if self.next is not None:
+                        self.next.put(output)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ {self.name} failed: {e}")
+                if self.on_error:
+                    self.on_error(self.name, item, e)
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """Chain of ``Stage`` objects connected by their bounded queues."""
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        for current, following in zip(stages, stages[1:]):
+            current.next = following
+        for stage in stages:
+            stage.on_error = on_error
+
+    def start(self, report_every=None):
+        for stage in self.stages:
+            stage.start()
+        if report_every:
+            threading.Thread(
+                target=self._report, args=(report_every,), name="pipeline-report", daemon=True
+            ).start()
+
+    def put(self, item):
+        self.stages[0].put(item)
+
+    def depths(self):
+        return {stage.name: stage.depth() for stage in self.stages}
+
+    def stats(self):
+        return {
+            stage.name: {"depth": stage.depth(), "processed": stage.processed, "failed": stage.failed}
+            for stage in self.stages
+        }
+
+    def _report(self, interval):
+        while True:
+            time.sleep(interval)
+            print("📊 Pipeline queues: " + ", ".join(
+                f"{name}={depth}" for name, depth in self.depths().items()))
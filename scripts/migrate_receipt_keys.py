@@ -0,0 +1,103 @@
+"""Rekey receipt documents so each one is stored under its own ``id``.
+
+Older receipts were created with ``collection.add()`` and live under an
+auto-generated key, with the real id in an ``id`` field. This copies every
+such document to ``receipt/<id>`` and deletes the old one in the same
+batch, so each document is either fully moved or untouched. Documents
+without an ``id`` field keep their key and get ``id`` set to it.
+
+Receipts written by the mail listener used to store ``date`` as a string;
+Firestore sorts strings above every timestamp, so those receipts topped the
+newest-first list whatever their date. Any string ``date`` is converted to
+a timestamp on the way (or null when it is not ISO 8601).
+
+The last processed key is written to a checkpoint file after every batch;
+re-running the script resumes from there. Documents that are already keyed
+by their id are skipped, so a run without the checkpoint is safe too.
+
+    python -m scripts.migrate_receipt_keys [--dry-run] [--batch-size 200]
+"""
+import argparse
+import os
+from service.receipt import parse_receipt_date
+from service.receipt_repository import COLLECTION_NAME as collection_name, get_firestore_client
+
+CHECKPOINT_PATH = ".migrate_receipt_keys.checkpoint"
+
+
+def read_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return f.read().strip() or None
+    return None
+
+
+def write_checkpoint(path, key):
+    with open(path, "w") as f:
+        f.write(key)
+
+
+def migrate(db, batch_size=200, dry_run=False, checkpoint_path=CHECKPOINT_PATH):
+    collection = db.collection(collection_name)
+    # Each move is a set + delete; Firestore caps a batch at 500 writes
+    batch_size = max(1, min(batch_size, 250))
+    last_key = read_checkpoint(checkpoint_path)
+    if last_key:
+        print(f"↪️ Resuming after {last_key}")
+
+    moved = fixed = dated = skipped = 0
+    while True:
+        query = collection.order_by('__name__').limit(batch_size)
+        if last_key:
+            # The last document was usually moved away, so resume from its key
+            # rather than from a snapshot
+            query = query.start_after({'__name__': collection.document(last_key)})
+        docs = list(query.stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        for doc in docs:
+            data = doc.to_dict()
+            receipt_id = data.get('id')
+            changes = {}
+            if isinstance(data.get('date'), str):
+                changes['date'] = data['date'] = parse_receipt_date(data['date'])
+                dated += 1
+            if not receipt_id:
+                batch.update(doc.reference, {'id': doc.id, **changes})
+                fixed += 1
+            elif receipt_id == doc.id:
+                if changes:
+                    batch.update(doc.reference, changes)
+                else:
+                    skipped += 1
+            else:
+                batch.set(collection.document(receipt_id), data)
+                batch.delete(doc.reference)
+                moved += 1
+
+        if not dry_run:
+            batch.commit()
+            write_checkpoint(checkpoint_path, docs[-1].id)
+        last_key = docs[-1].id
+        print(f"… processed up to {last_key}: moved={moved} fixed={fixed} dated={dated} skipped={skipped}")
+
+    if not dry_run and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"✅ Done{' (dry run)' if dry_run else ''}: moved={moved} fixed={fixed} dated={dated} "
+          f"skipped={skipped}")
+    return {"moved": moved, "fixed": fixed, "dated": dated, "skipped": skipped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rekey receipt documents by their id field and fix string dates.")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    args = parser.parse_args()
+    migrate(get_firestore_client(), args.batch_size, args.dry_run, args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Recompute the spend rollups behind ``/receipt/summary`` from all receipts.
+
+Normal writes keep the rollups up to date incrementally. Run this once to
+backfill receipts stored before the rollups existed, or to repair them after
+receipts were changed outside the API. The receipts are paged through in
+``--page-size`` chunks and the rollup documents are replaced in one batch at
+the end; writes that land while the rebuild runs may be counted twice or not
+at all, so run it during a quiet period.
+
+    python -m scripts.rebuild_receipt_rollups [--dry-run] [--page-size 500]
+"""
+import argparse
+from service.receipt_repository import get_receipt_repository, iter_receipts
+from service.receipt_rollups import build_rollups, summarize
+
+
+def rebuild(repository, page_size=500, dry_run=False):
+    rollups = build_rollups(iter_receipts(repository, page_size))
+    summary = summarize(rollups)
+    if not dry_run:
+        repository.replace_rollups(rollups)
+    print(f"✅ Done{' (dry run)' if dry_run else ''}: {summary['count']} receipts, "
+          f"total {summary['total']}, "
+          + ", ".join(f"{dimension}={len(rollups.get(dimension, {}))}"
+                      for dimension in ('category', 'biller', 'month')))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the receipt spend rollups.")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    rebuild(get_receipt_repository(), max(1, args.page_size), args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
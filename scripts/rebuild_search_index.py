@@ -0,0 +1,30 @@
+"""Rebuild the local receipt search index from the whole collection.
+
+The index behind ``/receipt/search`` is kept up to date by every write made
+through the API and the mail listener (both share ``SEARCH_INDEX_PATH``), and
+a process that finds no snapshot builds one itself on first use. Run this to
+pick up receipts written by a process that does not share the index files.
+
+    python -m scripts.rebuild_search_index [--page-size 500]
+"""
+import argparse
+import time
+from service.receipt_repository import get_receipt_repository, iter_receipts
+from service.receipt_search import SEARCH_INDEX_PATH, SearchIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the receipt search index.")
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    # Not get_search_index(): it would scan the collection itself when no snapshot exists
+    index = SearchIndex(SEARCH_INDEX_PATH or None)
+    index.rebuild(iter_receipts(get_receipt_repository(), max(1, args.page_size)))
+    print(f"✅ Indexed {len(index)} receipts ({len(index.vocabulary)} distinct words) "
+          f"in {time.perf_counter() - started:.1f}s -> {index.path}")
+
+
+if __name__ == "__main__":
+    main()
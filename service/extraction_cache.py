@@ -0,0 +1,161 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from service.startup import startup_report
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.sqlite3")
+EXTRACTION_CACHE_MEMORY_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MEMORY_ENTRIES", 256))
+EXTRACTION_CACHE_DISK_ENTRIES = int(os.getenv("EXTRACTION_CACHE_DISK_ENTRIES", 10000))
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+
+def make_cache_key(content_hash: str, model_name: str, prompt_version: str) -> str:
+    """Content address for a file: same sha256 + same model/prompt -> same key."""
+    return f"{model_name}:{prompt_version}:{content_hash}"
+
+
+class ExtractionCache:
+    """Two-tier cache of parsed invoices.
+
+    Tier 1 is an in-process LRU, tier 2 a SQLite table that survives restarts.
+    Entries older than ``ttl_seconds`` are treated as misses and dropped, and
+    each tier is trimmed to its own entry limit (oldest / least recently used
+    first).
+    """
+
+    def __init__(
+        self,
+        path: str = EXTRACTION_CACHE_PATH,
+        memory_entries: int = EXTRACTION_CACHE_MEMORY_ENTRIES,
+        disk_entries: int = EXTRACTION_CACHE_DISK_ENTRIES,
+        ttl_seconds: int = EXTRACTION_CACHE_TTL_SECONDS
+    ):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _db(self):
+        if self._conn is None:
+            with startup_report.timed("client", "extraction_cache"):
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " value TEXT NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_extraction_cache_accessed"
+                    " ON extraction_cache (accessed_at)"
+                )
+                self._conn.commit()
+        return self._conn
+
+    def _expired(self, created_at, now):
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return json.loads(value)
+                del self._memory[key]
+
+            try:
+                db = self._db()
+                row = db.execute(
+                    "SELECT value, created_at FROM extraction_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if self._expired(created_at, now):
+                        db.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                    else:
+                        db.execute(
+                            "UPDATE extraction_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                        )
+                        db.commit()
+                        self._remember(key, value, created_at)
+                        self.counters["disk_hits"] += 1
+                        return json.loads(value)
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Extraction cache read failed: {e}")
+
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key: str, invoice_info: dict):
+        now = time.time()
+        value = json.dumps(invoice_info)
+        with self._lock:
+            self._remember(key, value, now)
+            self.counters["writes"] += 1
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._evict_disk(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Extraction cache write failed: {e}")
+
+    def _evict_disk(self, db, now):
+        if self.ttl_seconds > 0:
+            cur = db.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+            self.counters["evictions"] += cur.rowcount
+        cur = db.execute(
+            "DELETE FROM extraction_cache WHERE key IN ("
+            " SELECT key FROM extraction_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        )
+        self.counters["evictions"] += cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            try:
+                db = self._db()
+                db.execute("DELETE FROM extraction_cache")
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ Extraction cache clear failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "memory_size": len(self._memory),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+extraction_cache = ExtractionCache()
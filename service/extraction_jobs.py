@@ -0,0 +1,187 @@
+import io
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from service.invoice_categorization import iter_invoices_from_files
+from service.receipt_repository import get_firestore_client
+from service.startup import startup_report
+
+JOB_STORE = os.getenv("JOB_STORE", "memory")  # memory | sqlite | firestore
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "extraction_jobs.sqlite3")
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 20))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MEMORY_MAX_JOBS = int(os.getenv("JOB_MEMORY_MAX_JOBS", 1000))
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue is at capacity; callers should retry later."""
+
+
+class InMemoryJobStore:
+    """Keeps the most recent jobs in process memory."""
+
+    def __init__(self, max_jobs=JOB_MEMORY_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = json.loads(json.dumps(job))
+            self._jobs.move_to_end(job["id"])
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+
+class SqliteJobStore:
+    """Stores jobs as JSON rows in a local SQLite file."""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_jobs ("
+            " id TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def save(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_jobs (id, value, updated_at) VALUES (?, ?, ?)",
+                (job["id"], json.dumps(job), job["updated_at"])
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM extraction_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class FirestoreJobStore:
+    """Stores jobs in a Firestore collection, keyed by job id."""
+
+    def __init__(self, collection_name="extraction_jobs"):
+        self._collection = get_firestore_client().collection(collection_name)
+
+    def save(self, job):
+        self._collection.document(job["id"]).set(job)
+
+    def get(self, job_id):
+        doc = self._collection.document(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+
+def make_job_store(kind=JOB_STORE):
+    stores = {
+        "memory": InMemoryJobStore,
+        "sqlite": SqliteJobStore,
+        "firestore": FirestoreJobStore,
+    }
+    if kind not in stores:
+        raise ValueError(f"Unknown JOB_STORE: {kind}")
+    with startup_report.timed("client", f"job_store_{kind}"):
+        return stores[kind]()
+
+
+class ExtractionJobQueue:
+    """Bounded queue of extraction jobs drained by a small worker pool.
+
+    ``submit`` never blocks: when ``queue_size`` jobs are already waiting it
+    raises ``JobQueueFull`` so the HTTP layer can answer 429 instead of tying
+    up a request thread. Workers start on the first submit.
+    """
+
+    def __init__(self, api_key, store=None, queue_size=JOB_QUEUE_SIZE, workers=JOB_WORKERS):
+        self.api_key = api_key
+        self.store = store or make_job_store()
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"extraction-job-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, file_list):
+        """Queue ``[(file_obj, filename), ...]`` and return the new job record.
+
+        File contents are copied into memory here because the request that
+        uploaded them is gone by the time a worker picks the job up.
+        """
+        self._ensure_workers()
+        now = time.time()
+        job = {
+            "id": uuid4().hex,
+            "status": "queued",
+            "files": [filename for _, filename in file_list],
+            "results": [None] * len(file_list),
+            "completed": 0,
+            "total": len(file_list),
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        buffered = [(io.BytesIO(file_obj.read()), filename) for file_obj, filename in file_list]
+        self.store.save(job)
+        submitted = dict(job)
+        try:
+            self._queue.put_nowait((job, buffered))
+        except queue.Full:
+            job["status"] = "rejected"
+            self.store.save(job)
+            raise JobQueueFull("Extraction queue is full, retry later")
+        return submitted
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def _work(self):
+        while True:
+            job, file_list = self._queue.get()
+            try:
+                self._run(job, file_list)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job, file_list):
+        job["status"] = "running"
+        job["updated_at"] = time.time()
+        self.store.save(job)
+        try:
+            for index, invoice_info in iter_invoices_from_files(self.api_key, file_list):
+                job["results"][index] = invoice_info
+                job["completed"] += 1
+                job["updated_at"] = time.time()
+                self.store.save(job)
+            job["status"] = "done"
+        except Exception as e:
+            print(f"❌ Extraction job {job['id']} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["updated_at"] = time.time()
+        self.store.save(job)
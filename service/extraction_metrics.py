@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import Counter, deque
+
+# Latency samples kept per model for the percentiles in stats()
+EXTRACTION_METRICS_SAMPLES = int(os.getenv("EXTRACTION_METRICS_SAMPLES", 1000))
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 1)
+
+
+class ExtractionMetrics:
+    """Per-model call counts, latencies, cascade escalations and parse outcomes.
+
+    Every model call is recorded with its latency and whether its answer
+    passed validation; ``record_escalation`` counts files the fast tier
+    handed on to the next one, by reason, and ``record_parse`` whether a
+    JSON-mode answer fit the invoice schema first time, after a repair
+    re-prompt, or not at all.
+    """
+
+    def __init__(self, samples=EXTRACTION_METRICS_SAMPLES):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._tiers = {}
+            self.escalations = 0
+            self.escalation_reasons = Counter()
+            self.parse_outcomes = Counter()
+
+    def record_call(self, model_name, elapsed_ms, problems=()):
+        with self._lock:
+            tier = self._tiers.setdefault(model_name, {
+                "calls": 0, "invalid": 0, "total_ms": 0.0,
+                "latencies": deque(maxlen=self.samples),
+            })
+            tier["calls"] += 1
+            tier["invalid"] += 1 if problems else 0
+            tier["total_ms"] += elapsed_ms
+            tier["latencies"].append(elapsed_ms)
+
+    def record_escalation(self, problems):
+        with self._lock:
+            self.escalations += 1
+            self.escalation_reasons.update(problems)
+
+    def record_parse(self, outcome):
+        with self._lock:
+            self.parse_outcomes[outcome] += 1
+
+    def stats(self, first_tier=None):
+        with self._lock:
+            tiers = {}
+            for name, tier in self._tiers.items():
+                latencies = sorted(tier["latencies"])
+                tiers[name] = {
+                    "calls": tier["calls"],
+                    "invalid": tier["invalid"],
+                    "mean_ms": round(tier["total_ms"] / tier["calls"], 1),
+                    "p50_ms": _percentile(latencies, 0.5),
+                    "p95_ms": _percentile(latencies, 0.95),
+                }
+            parsed = sum(self.parse_outcomes.values())
+            first_calls = tiers.get(first_tier, {}).get("calls", 0) if first_tier else 0
+            return {
+                "tiers": tiers,
+                "escalations": self.escalations,
+                "escalation_rate": round(self.escalations / first_calls, 3) if first_calls else 0.0,
+                "escalation_reasons": dict(self.escalation_reasons),
+                "parse": {
+                    "ok": self.parse_outcomes["ok"],
+                    "repaired": self.parse_outcomes["repaired"],
+                    "malformed": self.parse_outcomes["malformed"],
+                    # first answers that did not fit the schema
+                    "malformed_rate": round(
+                        (parsed - self.parse_outcomes["ok"]) / parsed, 3) if parsed else 0.0,
+                },
+            }
+
+
+extraction_metrics = ExtractionMetrics()
@@ -0,0 +1,223 @@
+import os
+import random
+import threading
+import time
+from functools import cache
+from service.startup import lazy_import
+
+# Quota of the Gemini project, shared by every caller in this process
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 60))
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", 250000))
+# In-flight calls start at the max and are halved on every 429, then grow
+# back by one slot per window of successful calls (AIMD)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", 1))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 5))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", 1))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", 60))
+
+# Gemini bills images in 768x768 tiles of 258 tokens each
+IMAGE_TILE_PIXELS = 768
+IMAGE_TILE_TOKENS = 258
+DEFAULT_IMAGE_TOKENS = 4 * IMAGE_TILE_TOKENS
+# Inline PDFs are billed per page; assume a few pages when we cannot tell
+DEFAULT_DOCUMENT_TOKENS = 3 * IMAGE_TILE_TOKENS
+
+
+@cache
+def retryable_errors():
+    """``(throttle_errors, transient_errors)``; google.api_core is loaded on the first call."""
+    google_exceptions = lazy_import("google.api_core.exceptions")
+    throttle_errors = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+    return throttle_errors, throttle_errors + (
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout,
+    )
+
+
+def estimate_image_tokens(size=None):
+    if not size:
+        return DEFAULT_IMAGE_TOKENS
+    width, height = size
+    tiles = -(-width // IMAGE_TILE_PIXELS) * -(-height // IMAGE_TILE_PIXELS)
+    return max(1, tiles) * IMAGE_TILE_TOKENS
+
+
+def estimate_text_tokens(text):
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 1
+
+
+def estimate_tokens(contents):
+    """Rough prompt size of a ``generate_content`` argument."""
+    if isinstance(contents, str):
+        return estimate_text_tokens(contents)
+    if isinstance(contents, dict):
+        if contents.get("mime_type", "").startswith("image/"):
+            return DEFAULT_IMAGE_TOKENS
+        return DEFAULT_DOCUMENT_TOKENS
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    # PIL images and anything else with a size
+    return estimate_image_tokens(getattr(contents, "size", None))
+
+
+class TokenBucket:
+    """Refills ``rate_per_minute`` units per minute, up to one minute's worth."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = max(1, rate_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Block until ``amount`` units are available and take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def debit(self, amount):
+        """Take units without waiting (may go negative), e.g. to settle an estimate."""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+
+
+class AdaptiveConcurrency:
+    """Concurrency limit that halves on throttling and creeps back up."""
+
+    def __init__(self, maximum=GEMINI_MAX_CONCURRENCY, minimum=GEMINI_MIN_CONCURRENCY):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                # +1 after roughly `limit` successes
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class GeminiClient:
+    """Process-wide gate in front of ``GenerativeModel.generate_content``.
+
+    Every call waits for a request slot and for its estimated tokens in two
+    token buckets (requests/min and tokens/min), and for a slot under the
+    adaptive concurrency limit. 429s and transient server errors are retried
+    with exponential backoff and jitter; anything else, or the last failed
+    attempt, is raised to the caller.
+    """
+
+    def __init__(self, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=GEMINI_TOKENS_PER_MINUTE,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY, min_concurrency=GEMINI_MIN_CONCURRENCY,
+                 max_retries=GEMINI_MAX_RETRIES, backoff_base=GEMINI_BACKOFF_BASE_SECONDS,
+                 backoff_max=GEMINI_BACKOFF_MAX_SECONDS):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def generate_content(self, model, contents, estimated_tokens=None, **kwargs):
+        estimated = estimated_tokens or estimate_tokens(contents)
+        throttle_errors, transient_errors = retryable_errors()
+        attempt = 0
+        while True:
+            self.requests.acquire()
+            self.tokens.acquire(estimated)
+            self.concurrency.acquire()
+            throttled = False
+            try:
+                self._count(calls=1)
+                response = model.generate_content(contents, **kwargs)
+            except transient_errors as e:
+                throttled = isinstance(e, throttle_errors)
+                if throttled:
+                    self._count(throttled=1)
+                if attempt >= self.max_retries:
+                    self._count(failures=1)
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                self._count(retries=1)
+                print(f"⏳ Gemini {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            except Exception:
+                self._count(failures=1)
+                raise
+            else:
+                usage = getattr(response, "usage_metadata", None)
+                actual = getattr(usage, "prompt_token_count", None) if usage else None
+                if actual:
+                    self.tokens.debit(actual - estimated)
+                return response
+            finally:
+                self.concurrency.release(throttled=throttled)
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "concurrency_limit": int(self.concurrency.limit),
+                "in_flight": self.concurrency.in_flight,
+            }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """The shared ``GeminiClient``; created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
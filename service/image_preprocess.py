@@ -0,0 +1,63 @@
+import io
+import os
+from typing import TYPE_CHECKING
+from service.startup import lazy_import
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") == "1"
+IMAGE_MAX_LONG_EDGE = int(os.getenv("IMAGE_MAX_LONG_EDGE", 1600))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") == "1"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def preprocess_signature(
+    max_long_edge=IMAGE_MAX_LONG_EDGE,
+    grayscale=IMAGE_GRAYSCALE,
+    fmt=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY
+):
+    """Short string describing the settings, used to keep cache entries apart."""
+    return f"pp-{max_long_edge}-{'L' if grayscale else 'RGB'}-{fmt.lower()}-{quality}"
+
+
+def preprocess_image(
+    image: "Image.Image",
+    original_bytes: int,
+    max_long_edge=IMAGE_MAX_LONG_EDGE,
+    grayscale=IMAGE_GRAYSCALE,
+    fmt=IMAGE_FORMAT,
+    quality=IMAGE_QUALITY
+):
+    """Shrink a receipt photo before it is sent to Gemini.
+
+    Applies the EXIF orientation, optionally converts to grayscale, downscales
+    so the long edge is at most ``max_long_edge`` and re-encodes as JPEG/WebP.
+    Returns ``(blob, report)`` where ``blob`` is the inline-data dict accepted
+    by ``generate_content`` and ``report`` holds the byte counts.
+    """
+    fmt = fmt.upper()
+    if fmt not in _MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {fmt}")
+
+    Image, ImageOps = lazy_import("PIL.Image"), lazy_import("PIL.ImageOps")
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L") if grayscale else image.convert("RGB")
+    if max_long_edge and max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=quality, optimize=True)
+    data = buffer.getvalue()
+
+    report = {
+        "original_bytes": original_bytes,
+        "processed_bytes": len(data),
+        "bytes_saved": original_bytes - len(data),
+        "size": list(image.size),
+    }
+    return {"mime_type": _MIME_TYPES[fmt], "data": data}, report
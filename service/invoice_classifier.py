@@ -0,0 +1,116 @@
+import os
+import re
+from service.startup import lazy_import
+
+# Score at or above which a document is treated as an invoice
+INVOICE_ACCEPT_SCORE = float(os.getenv("INVOICE_ACCEPT_SCORE", 0.4))
+# Score at which scanning stops early; later pages cannot change the answer
+INVOICE_CONFIDENT_SCORE = float(os.getenv("INVOICE_CONFIDENT_SCORE", 0.8))
+# A page with fewer characters than this is treated as having no text layer
+MIN_TEXT_CHARS = 20
+
+# (name, weight, pattern). Each feature counts once, however often it matches.
+FEATURES = [
+    ("keyword", 0.35, re.compile(
+        r"\b(tax\s+invoice|invoice|receipt|bill\s+of\s+supply|bill|cash\s+memo)\b", re.I)),
+    ("total", 0.2, re.compile(
+        r"\b(grand\s+total|total|amount\s+(due|payable)|net\s+payable|balance\s+due)\b", re.I)),
+    ("amount", 0.15, re.compile(
+        r"(₹|rs\.?|inr|\$|€|£)\s?\d[\d,]*(\.\d{1,2})?|\b\d{1,3}(,\d{2,3})*\.\d{2}\b", re.I)),
+    ("date", 0.1, re.compile(
+        r"\b(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}|"
+        r"\d{1,2}\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{2,4})\b", re.I)),
+    ("gstin", 0.2, re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")),
+]
+NEGATIVE = ("negative", -0.2, re.compile(r"\b(unsubscribe|newsletter|catalogue|catalog|brochure)\b", re.I))
+
+# Scanned pages cannot be scored from text. A till-roll shaped page is very
+# likely a receipt; anything else is "maybe" and left to the vision model.
+SCANNED_SCORE = 0.5
+SCANNED_TALL_SCORE = 0.7
+TALL_ASPECT_RATIO = 2.0
+THUMBNAIL_ZOOM = 0.25
+
+
+def text_features(text):
+    """Names of the features found in ``text``."""
+    return {name for name, _, pattern in FEATURES + [NEGATIVE] if pattern.search(text)}
+
+
+def score_features(features):
+    weights = {name: weight for name, weight, _ in FEATURES + [NEGATIVE]}
+    return max(0.0, min(1.0, sum(weights[name] for name in features)))
+
+
+def score_text(text):
+    """Weighted keyword/regex score in [0, 1] for one blob of text."""
+    return score_features(text_features(text))
+
+
+def classify_pdf(data=None, path=None, accept=INVOICE_ACCEPT_SCORE,
+                 confident=INVOICE_CONFIDENT_SCORE, max_pages=None, keep_text=False):
+    """Decide whether a PDF looks like an invoice without reading all of it.
+
+    Pages are read one at a time and their features accumulated; scanning
+    stops at the first page where the score reaches ``confident``. A page
+    without a text layer is rendered to a small thumbnail and scored by shape
+    instead (``scanned`` is set and the PNG is returned in ``thumbnail``).
+
+    Returns a dict with ``is_invoice``, ``score``, ``features``,
+    ``pages_scanned``, ``page_count``, ``scanned``, ``thumbnail`` and, with
+    ``keep_text``, the ``text`` of every page (the scan then never stops
+    early, since the caller needs all of it).
+    """
+    fitz = lazy_import("fitz")  # PyMuPDF
+    doc = fitz.open(stream=data, filetype="pdf") if data is not None else fitz.open(path)
+    try:
+        features = set()
+        texts = []
+        scanned_score = 0.0
+        thumbnail = None
+        pages_scanned = 0
+        for page in doc:
+            if max_pages and pages_scanned >= max_pages:
+                break
+            pages_scanned += 1
+            text = page.get_text()
+            if keep_text:
+                texts.append(text)
+
+            if len(text.strip()) >= MIN_TEXT_CHARS:
+                features |= text_features(text)
+            elif thumbnail is None:
+                pixmap = page.get_pixmap(matrix=fitz.Matrix(THUMBNAIL_ZOOM, THUMBNAIL_ZOOM))
+                thumbnail = pixmap.tobytes("png")
+                tall = pixmap.height / max(pixmap.width, 1) >= TALL_ASPECT_RATIO
+                scanned_score = SCANNED_TALL_SCORE if tall else SCANNED_SCORE
+
+            score = max(score_features(features), scanned_score)
+            if score >= confident and not keep_text:
+                break
+
+        score = max(score_features(features), scanned_score)
+        result = {
+            "is_invoice": score >= accept,
+            "score": round(score, 3),
+            "features": sorted(features),
+            "pages_scanned": pages_scanned,
+            "page_count": doc.page_count,
+            "scanned": thumbnail is not None and not features,
+            "thumbnail": thumbnail,
+        }
+        if keep_text:
+            result["text"] = "".join(texts)
+        return result
+    finally:
+        doc.close()
+
+
+def render_page(data=None, path=None, page_number=0, zoom=2.0):
+    """PNG of one page, for sending scanned PDFs to a vision model."""
+    fitz = lazy_import("fitz")
+    doc = fitz.open(stream=data, filetype="pdf") if data is not None else fitz.open(path)
+    try:
+        return doc[page_number].get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+    finally:
+        doc.close()
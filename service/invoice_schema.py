@@ -0,0 +1,151 @@
+import json
+from typing import Optional, TypedDict
+from service.extraction_metrics import extraction_metrics
+from service.gemini_client import get_gemini_client
+from service.invoice_validation import to_amount
+
+# Gemini response schema (OpenAPI subset). Every extraction prompt asks for
+# this shape, and the model is constrained to it with JSON mode.
+INVOICE_PROPERTIES = {
+    "biller_name": {"type": "STRING", "description": "Person/shop/organization that issued the bill"},
+    "billing_date": {"type": "STRING", "nullable": True, "description": "Date of the bill, YYYY-MM-DD"},
+    "category": {"type": "STRING", "description": "Spending category, e.g. grocery, rent, utility, food"},
+    "items": {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {"item": {"type": "STRING"}, "price": {"type": "NUMBER"}},
+            "required": ["item", "price"],
+        },
+    },
+    "total": {"type": "NUMBER", "description": "Total amount of the bill"},
+}
+INVOICE_REQUIRED = ["biller_name", "billing_date", "category", "items", "total"]
+INVOICE_SCHEMA = {"type": "OBJECT", "properties": INVOICE_PROPERTIES, "required": INVOICE_REQUIRED}
+# Several documents in one request, told apart by the doc_id of their header
+INVOICE_BATCH_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"doc_id": {"type": "STRING"}, **INVOICE_PROPERTIES},
+        "required": ["doc_id"] + INVOICE_REQUIRED,
+    },
+}
+
+REPAIR_PROMPT = """Your previous answer for this invoice did not match the required JSON schema:
+{errors}
+
+Previous answer:
+{previous}
+
+Answer again with only the corrected JSON object."""
+
+
+class InvoiceItem(TypedDict):
+    item: str
+    price: float
+
+
+class Invoice(TypedDict):
+    biller_name: str
+    billing_date: Optional[str]
+    category: str
+    items: list  # of InvoiceItem
+    total: float
+
+
+class InvoiceSchemaError(ValueError):
+    """A model answer that does not fit ``INVOICE_SCHEMA``."""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+def json_config(schema=INVOICE_SCHEMA):
+    """``generation_config`` that puts Gemini in schema-constrained JSON mode."""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def coerce_invoice(data):
+    """Check one decoded answer against the schema and return an ``Invoice``.
+
+    Numbers sent as strings (``"₹1,234.50"``) are accepted and converted;
+    anything else that does not fit raises ``InvoiceSchemaError``.
+    """
+    if not isinstance(data, dict):
+        raise InvoiceSchemaError([f"expected an object, got {type(data).__name__}"])
+
+    problems = []
+    for field in ("biller_name", "category"):
+        if not isinstance(data.get(field), str):
+            problems.append(f"{field}: expected a string")
+    billing_date = data.get("billing_date")
+    if billing_date is not None and not isinstance(billing_date, str):
+        problems.append("billing_date: expected a string or null")
+    total = to_amount(data.get("total"))
+    if total is None:
+        problems.append("total: expected a number")
+
+    items = []
+    raw_items = data.get("items")
+    if not isinstance(raw_items, list):
+        problems.append("items: expected an array")
+        raw_items = []
+    for i, entry in enumerate(raw_items):
+        price = to_amount(entry.get("price")) if isinstance(entry, dict) else None
+        if not isinstance(entry, dict) or not isinstance(entry.get("item"), str) or price is None:
+            problems.append(f"items[{i}]: expected {{item: string, price: number}}")
+            continue
+        items.append(InvoiceItem(item=entry["item"], price=price))
+
+    if problems:
+        raise InvoiceSchemaError(problems)
+    return Invoice(
+        biller_name=data["biller_name"],
+        billing_date=billing_date,
+        category=data["category"],
+        items=items,
+        total=total,
+    )
+
+
+def parse_invoice_json(text):
+    """Decode and check one JSON-mode answer; no regex salvage needed."""
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise InvoiceSchemaError([f"invalid JSON: {e}"])
+    return coerce_invoice(data)
+
+
+def generate_invoice(model, contents, label=""):
+    """Ask ``model`` for one invoice in JSON mode, repairing once if needed.
+
+    Returns ``(invoice, raw_text)``; ``invoice`` is None when the answer is
+    still malformed after the repair re-prompt. The outcome (ok, repaired,
+    malformed) is counted in ``extraction_metrics``. Errors from the model
+    call itself propagate.
+    """
+    gemini = get_gemini_client()
+    raw_text = gemini.generate_content(model, contents, generation_config=json_config()).text
+    try:
+        invoice = parse_invoice_json(raw_text)
+        extraction_metrics.record_parse("ok")
+        return invoice, raw_text
+    except InvoiceSchemaError as e:
+        print(f"🔧 {label}: answer failed the invoice schema ({e}), asking for a repair")
+        problems = e.problems
+
+    # The document goes along again so missing fields can be filled in
+    repair = REPAIR_PROMPT.format(errors="\n".join(f"- {p}" for p in problems), previous=raw_text)
+    parts = list(contents) if isinstance(contents, (list, tuple)) else [contents]
+    raw_text = gemini.generate_content(model, parts + [repair], generation_config=json_config()).text
+    try:
+        invoice = parse_invoice_json(raw_text)
+        extraction_metrics.record_parse("repaired")
+        return invoice, raw_text
+    except InvoiceSchemaError as e:
+        print(f"⚠️ {label}: answer still malformed after repair ({e})")
+        extraction_metrics.record_parse("malformed")
+        return None, raw_text
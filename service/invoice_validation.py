@@ -0,0 +1,64 @@
+import os
+import re
+from datetime import datetime
+
+REQUIRED_FIELDS = ("biller_name", "billing_date", "items", "total")
+# Items may miss the total by this fraction of it (tax, rounding, discounts)
+# or by TOTAL_TOLERANCE_ABSOLUTE, whichever is larger
+TOTAL_TOLERANCE = float(os.getenv("EXTRACTION_TOTAL_TOLERANCE", 0.02))
+TOTAL_TOLERANCE_ABSOLUTE = float(os.getenv("EXTRACTION_TOTAL_TOLERANCE_ABSOLUTE", 1.0))
+
+_AMOUNT = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+
+def to_amount(value):
+    """``12.5``, ``"₹1,234.50"`` or ``"Rs. 3"`` as float; None if not a number."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = _AMOUNT.search(value)
+    return float(match.group().replace(",", "")) if match else None
+
+
+def validate_invoice(invoice_info):
+    """Problems with one extraction, as short codes; empty when it looks right.
+
+    Checks that the model answer parsed, that the required fields are there,
+    that ``billing_date`` is a real YYYY-MM-DD date and that the item prices
+    add up to ``total`` within tolerance. ``items`` may be a list of
+    ``{"item", "price"}`` or the name -> price dict the extractor produces.
+    """
+    if "error" in invoice_info or "raw_response" in invoice_info:
+        return ["unparsed"]
+
+    problems = [f"missing:{field}" for field in REQUIRED_FIELDS
+                if invoice_info.get(field) in (None, "", [], {}, "unknown")]
+
+    date = invoice_info.get("billing_date")
+    if date and "missing:billing_date" not in problems:
+        try:
+            datetime.strptime(str(date), "%Y-%m-%d")
+        except ValueError:
+            problems.append("invalid_date")
+
+    total = to_amount(invoice_info.get("total"))
+    if invoice_info.get("total") not in (None, "") and total is None:
+        problems.append("invalid_total")
+
+    items = invoice_info.get("items")
+    if isinstance(items, dict):
+        prices = list(items.values())
+    elif isinstance(items, list):
+        prices = [item.get("price") for item in items if isinstance(item, dict)]
+    else:
+        prices = []
+    amounts = [to_amount(price) for price in prices]
+    if total is not None and amounts and None not in amounts:
+        tolerance = max(TOTAL_TOLERANCE_ABSOLUTE, abs(total) * TOTAL_TOLERANCE)
+        if abs(sum(amounts) - total) > tolerance:
+            problems.append("total_mismatch")
+
+    return problems
@@ -1,140 +1,557 @@
-from flask import Blueprint, jsonify, Flask, request
-from google.cloud import firestore
-from datetime import datetime
-import os
+from flask import jsonify, Response
+from datetime import datetime, timezone
+import hashlib
+import json
+import time
 from uuid import uuid4
+from werkzeug.http import http_date
+from service.receipt_cache import TTLCache
+from service.receipt_columns import SORT_COLUMNS, ReceiptColumns, to_datetime
+from service.receipt_dedup import (
+    RECEIPT_DEDUP, check_fingerprint, merge_duplicate, receipt_fingerprint, remember_attachment
+)
+from service.receipt_repository import FingerprintTaken, get_receipt_repository
+from service.receipt_rollups import DIMENSIONS, rollup_changes, summarize
+from service.receipt_search import get_search_index
 
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "service-account.json"
-db = firestore.Client()
-collection_name = 'receipt'
+RECEIPT_FIELDS = ('id', 'biller_name', 'date', 'bill_value', 'items', 'transaction_id', 'category',
+                  'updated_at')
+MAX_PAGE_SIZE = 500
 
+# Read-through cache for list pages and single receipts. Every write path
+# calls invalidate_receipts(), the TTL bounds staleness for writers living in
+# other processes.
+receipt_cache = TTLCache()
 
 
-def addReceipt(data):
+def invalidate_receipts(receipt_id=None):
+    """Drop cached list pages and summaries and, if given, the cached copy of one receipt."""
+    receipt_cache.invalidate_namespace('list')
+    receipt_cache.invalidate_namespace('summary')
+    receipt_cache.invalidate_namespace('columns')
+    if receipt_id:
+        receipt_cache.invalidate(('id', receipt_id))
+
+
+
+def index_receipt(receipt):
+    """Add a written receipt to the search index; never fails the write."""
+    try:
+        get_search_index().add(receipt)
+    except Exception as e:
+        print(f"⚠️ Could not index receipt {receipt.get('id')}: {e}")
+
+
+def parse_receipt_date(value):
+    """Stored form of a receipt date: a datetime, or None when it is missing or not ISO 8601.
+
+    Firestore orders values by type before value, so a date stored as a
+    string would sort above every timestamp in the newest-first list.
+    """
+    if isinstance(value, datetime) or value is None:
+        return value
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+def build_receipt(data):
+    """Validate an incoming receipt and return the document to store.
+
+    Raises ValueError when required fields are missing or the date is not ISO
+    8601. Shared by the single and bulk add paths.
+    """
     # Basic validation
     required_fields = ['biller_name', 'bill_value', 'date', 'items']
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
+        raise ValueError('Missing required fields')
+
+    # Convert date string to Firestore Timestamp
+    if not isinstance(data['date'], str):
+        raise ValueError('date must be an ISO 8601 string')
+    date = datetime.fromisoformat(data['date'])
+    # Create document, keyed by its own id so reads are direct gets
+    obj = {
+        'id': uuid4().hex,
+        'date': date,
+        'items': data['items'],
+        "bill_value": data["bill_value"],
+        "biller_name": data["biller_name"],
+    }
+
+    if data.get('transaction_id'):
+        obj['transaction_id'] = data['transaction_id']
+    if data.get('category'):
+        obj['category'] = data['category']
+    return obj
+
+
+def settle_duplicate(duplicate_of, obj):
+    """Merge ``obj`` into the stored receipt it duplicates; "merged" or "skipped"."""
+    duplicate = merge_duplicate(duplicate_of, obj)
+    if duplicate == 'merged':
+        invalidate_receipts(duplicate_of)
+    return duplicate
+
+
+def store_receipt(obj, attachment_hash=None):
+    """Write one receipt from ``build_receipt`` unless it is already stored.
+
+    Returns ``(receipt_id, duplicate)``: ``duplicate`` is None for a new
+    receipt, otherwise "skipped" or "merged" and ``receipt_id`` is the
+    existing one. ``attachment_hash`` (sha256 of the source file) is
+    remembered so the same file is not sent to the model again.
+    """
+    duplicate_of, claim = check_fingerprint(obj) if RECEIPT_DEDUP else (None, None)
+    if not duplicate_of:
+        try:
+            get_receipt_repository().add(obj, rollup=rollup_changes, fingerprint=claim)
+        except FingerprintTaken:
+            # A concurrent writer stored the same receipt first
+            duplicate_of, _ = check_fingerprint(obj)
+            if not duplicate_of:
+                raise
+
+    if duplicate_of:
+        receipt_id, duplicate = duplicate_of, settle_duplicate(duplicate_of, obj)
+    else:
+        invalidate_receipts()
+        index_receipt(obj)
+        receipt_id, duplicate = obj['id'], None
+
+    if attachment_hash:
+        remember_attachment(attachment_hash, receipt_id)
+    return receipt_id, duplicate
+
+
+def addReceipt(data):
     print(data)
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing required fields'})
+    try:
+        obj = build_receipt(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)})
 
     try:
-        # Convert date string to Firestore Timestamp
-        date = datetime.fromisoformat(data['date'])
-        print(data["items"])
-        # Create document
-        obj = {
-            'id': uuid4().hex,
-            'date': date,
-            'items': data['items'],
-            "bill_value": data["bill_value"],
-            "biller_name": data["biller_name"],
-        }
-
-        if data.get('transaction_id'):
-            obj['transaction_id'] = data['transaction_id']
-        doc_ref = db.collection(collection_name).add(obj)
-
-        return jsonify({'message': 'Document added', 'id': doc_ref[1].id})
+        receipt_id, duplicate = store_receipt(obj, data.get('attachment_hash'))
+        if duplicate:
+            return jsonify({'message': f'Duplicate receipt {duplicate}', 'id': receipt_id,
+                            'duplicate': duplicate})
+
+        return jsonify({'message': 'Document added', 'id': receipt_id})
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
 
-def convert_to_float(x):
-    x['price'] = str(x['price']) if 'price' in x else "0"
-    return x
+def addReceiptsBulk(items):
+    """Validate and store many receipts with batched writes.
+
+    Every item is validated like ``addReceipt``; valid ones are written in
+    repository batches (``WriteBatch`` chunks on Firestore). Returns one result per input item, in order, with
+    either the new ``id`` or an ``error``. Duplicates of stored receipts, or
+    of an earlier item in the same request, are not written; their result
+    carries the existing ``id`` and ``duplicate`` ("skipped" or "merged").
+    Duplicates within the request are settled after the batch is written, so
+    if the earlier item failed the later one is written in its place.
+    """
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a list of receipts'})
+
+    results = [None] * len(items)
+    pending = []
+    repeats = []
+    seen = set()
+    for index, data in enumerate(items):
+        try:
+            obj = build_receipt(data)
+        except ValueError as e:
+            results[index] = {'index': index, 'error': str(e)}
+            continue
+
+        attachment_hash = data.get('attachment_hash')
+        claim = None
+        if RECEIPT_DEDUP:
+            fingerprint = receipt_fingerprint(obj)
+            if fingerprint in seen:
+                # Same receipt as an earlier item, whose write may still fail
+                repeats.append((index, obj, attachment_hash))
+                continue
+            duplicate_of, claim = check_fingerprint(obj)
+            if duplicate_of:
+                if attachment_hash:
+                    remember_attachment(attachment_hash, duplicate_of)
+                results[index] = {'index': index, 'id': duplicate_of,
+                                  'duplicate': settle_duplicate(duplicate_of, obj)}
+                continue
+            seen.add(fingerprint)
+        pending.append((index, obj, attachment_hash, claim))
+
+    errors = get_receipt_repository().add_many(
+        [obj for _, obj, _, _ in pending], rollup=rollup_changes,
+        fingerprints=[claim for _, _, _, claim in pending])
+    for (index, obj, attachment_hash, _), error in zip(pending, errors):
+        # A concurrent writer may have stored the same receipt first
+        duplicate_of = check_fingerprint(obj)[0] if error and RECEIPT_DEDUP else None
+        if duplicate_of:
+            if attachment_hash:
+                remember_attachment(attachment_hash, duplicate_of)
+            results[index] = {'index': index, 'id': duplicate_of,
+                              'duplicate': settle_duplicate(duplicate_of, obj)}
+            continue
+        if error:
+            results[index] = {'index': index, 'error': error}
+            continue
+        if attachment_hash:
+            remember_attachment(attachment_hash, obj['id'])
+        index_receipt(obj)
+        results[index] = {'index': index, 'id': obj['id']}
+
+    # Duplicates of the earlier item once it is stored, or written themselves if it failed
+    for index, obj, attachment_hash in repeats:
+        try:
+            receipt_id, duplicate = store_receipt(obj, attachment_hash)
+        except Exception as e:
+            results[index] = {'index': index, 'error': str(e)}
+            continue
+        results[index] = {'index': index, 'id': receipt_id}
+        if duplicate:
+            results[index]['duplicate'] = duplicate
+
+    if pending:
+        invalidate_receipts()
+    added = sum(1 for r in results if 'id' in r and 'duplicate' not in r)
+    duplicates = sum(1 for r in results if 'duplicate' in r)
+    return jsonify({'added': added, 'duplicates': duplicates,
+                    'failed': len(results) - added - duplicates, 'results': results})
 
 
-def getAllReceipts():
+def convert_to_float(x):
+    # Copy, so cached receipts and request bodies are left alone
+    return {**x, 'price': str(x['price']) if 'price' in x else "0"}
+
+
+def to_iso(raw_date):
+    """ISO 8601 string of a stored datetime or date string, or None."""
+    if isinstance(raw_date, datetime):
+        return raw_date.isoformat()
+    if isinstance(raw_date, str):
+        try:
+            return datetime.fromisoformat(raw_date).isoformat()
+        except ValueError:
+            return None
+    return None
+
+
+def normalize_receipt(data, fields=None):
+    """Shape a stored receipt document for the API, optionally projected."""
+    result = {}
+    wanted = fields or RECEIPT_FIELDS
+
+    for field in ('date', 'updated_at'):
+        if field in wanted:
+            # Handle dates safely
+            result[field] = to_iso(data.get(field))
+
+    if 'items' in wanted:
+        # Normalize items field
+        items_raw = data.get('items', {})
+        items_list = []
+
+        if isinstance(items_raw, dict):
+            items_list = [
+                {"item": key, "price": value}
+                for key, value in items_raw.items()
+            ]
+        elif isinstance(items_raw, list):
+            # Already a list of dicts, assume correct
+            items_list = items_raw
+        # else: leave items_list as []
+        result['items'] = [convert_to_float(item) for item in items_list if isinstance(item, dict)]
+
+    for field in ('id', 'biller_name', 'bill_value', 'transaction_id', 'category'):
+        if field in wanted:
+            result[field] = data.get(field)
+    return result
+
+
+def parse_filters(args):
+    """``from``, ``to``, ``biller``, ``category``, ``min_total`` and ``max_total``
+    query arguments as ``ReceiptColumns.select`` keywords (only those given)."""
+    filters = {}
+    for arg, name in (('from', 'start'), ('to', 'end'), ('biller', 'biller'), ('category', 'category')):
+        if args.get(arg):
+            filters[name] = args.get(arg)
+    for name in ('min_total', 'max_total'):
+        if args.get(name):
+            try:
+                filters[name] = float(args.get(name))
+            except ValueError:
+                raise ValueError(f"{name} must be a number")
+    return filters
+
+
+def parse_sort(raw_sort):
+    """``sort=bill_value`` (ascending) or ``sort=-bill_value`` as ``(column, descending)``."""
+    if not raw_sort:
+        return 'date', True
+    column = raw_sort.lstrip('-')
+    if column not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {column}")
+    return column, raw_sort.startswith('-')
+
+
+def parse_fields(raw_fields):
+    """Turn ``fields=a,b`` into a validated tuple (``id`` is always included)."""
+    if not raw_fields:
+        return None
+    fields = [f.strip() for f in raw_fields.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in RECEIPT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(dict.fromkeys(['id'] + fields))
+
+
+def stream_json_array(rows):
+    """Encode an iterable of dicts as a JSON array one element at a time."""
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row)
+    yield ']'
+
+
+def sync_cursor(moment):
+    """``X-Sync-Cursor`` value for a write time: UTC ISO 8601 with a ``Z``."""
+    if moment is None:
+        return None
+    return moment.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def list_validators(state, args):
+    """``(etag, last_modified)`` of a ``/get-all`` response.
+
+    The ETag combines the receipt sync version (bumped by every write) with
+    the query arguments, so it changes exactly when the response would.
+    """
+    arguments = json.dumps(sorted(args.items(multi=True)))
+    digest = hashlib.sha1(arguments.encode()).hexdigest()[:16]
+    return f'"{state["version"]}-{digest}"', state['updated_at']
+
+
+def is_not_modified(conditional, etag, last_modified):
+    """Whether the client's cached copy is current; ``conditional`` is the
+    incoming request (its ``If-None-Match``/``If-Modified-Since``)."""
+    if conditional.if_none_match:
+        # An ETag check takes precedence over the date
+        return conditional.if_none_match.contains_weak(etag.strip('"'))
+    if last_modified and conditional.if_modified_since:
+        # HTTP dates have whole seconds
+        return last_modified.replace(microsecond=0) <= conditional.if_modified_since
+    return False
+
+
+def validator_headers(etag, last_modified):
+    """``ETag``/``Last-Modified`` headers, plus the ``X-Sync-Cursor`` of a full list."""
+    headers = {'ETag': etag}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+        headers['X-Sync-Cursor'] = sync_cursor(last_modified)
+    return headers
+
+
+def get_sync_state():
+    """Version and time of the last receipt write, read fresh on every call."""
+    return get_receipt_repository().sync_state()
+
+
+def getAllReceipts(limit=None, start_after=None, fields=None, version=None, headers=None):
+    """List receipts newest first.
+
+    ``limit`` caps the page size and ``start_after`` is the cursor returned in
+    the ``X-Next-Cursor`` header of the previous page. ``fields`` projects the
+    documents server side via ``select()``. Pages are served from
+    ``receipt_cache`` when possible and the body is encoded incrementally;
+    ``version`` (the sync version) is part of the cache key, so a write made
+    by another process is never hidden behind a cached page. Without a
+    ``limit`` nothing is cached: the receipts are encoded straight from the
+    repository stream, so the whole collection is never held in memory.
+    ``headers`` are added to a successful response.
+    """
     try:
-        collection_ref = db.collection(collection_name)
-        docs = collection_ref.stream()
-        results = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Handle date safely
-            raw_date = data.get('date')
-            iso_date = None
-            if isinstance(raw_date, datetime):
-                iso_date = raw_date.isoformat()
-            elif isinstance(raw_date, str):
-                try:
-                    iso_date = datetime.fromisoformat(raw_date).isoformat()
-                except ValueError:
-                    iso_date = None
-
-            # Normalize items field
-            items_raw = data.get('items', {})
-            items_list = []
-
-            if isinstance(items_raw, dict):
-                items_list = [
-                    {"item": key, "price": value}
-                    for key, value in items_raw.items()
-                ]
-            elif isinstance(items_raw, list):
-                # Already a list of dicts, assume correct
-                items_list = items_raw
-            # else: leave items_list as []
-
-            results.append({
-                'id': data.get('id'),
-                'biller_name': data.get('biller_name'),
-                'date': iso_date,
-                'bill_value': data.get('bill_value'),
-                'items': list(map(convert_to_float, data.get('items', []))),
-                "transaction_id": data.get('transaction_id', None),
-            })
-        return jsonify(results)
+        if not limit:
+            try:
+                docs = get_receipt_repository().stream(start_after, fields)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            body = stream_json_array(normalize_receipt(data, fields) for data in docs)
+            return Response(body, mimetype='application/json', headers=dict(headers or {}))
+
+        limit = min(limit, MAX_PAGE_SIZE)
+        cache_key = ('list', version, limit, start_after, fields)
+        page = receipt_cache.get(cache_key)
+        if page is None:
+            try:
+                docs, next_cursor = get_receipt_repository().list(limit, start_after, fields)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            page = ([normalize_receipt(data, fields) for data in docs], next_cursor)
+            receipt_cache.set(cache_key, page)
+
+        rows, next_cursor = page
+        headers = dict(headers or {})
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        return Response(stream_json_array(rows), mimetype='application/json', headers=headers)
 
     except Exception as e:
         return jsonify({'error': str(e)})
 
 
+def get_receipt_columns(version=None):
+    """Columnar snapshot of every receipt, cached until the next write or TTL.
+
+    With a sync ``version`` the snapshot is also rebuilt when it was taken at
+    another version.
+    """
+    cached = receipt_cache.get(('columns',))
+    if cached is None or (version is not None and cached[0] != version):
+        docs, _ = get_receipt_repository().list()
+        cached = (version, ReceiptColumns(docs))
+        receipt_cache.set(('columns',), cached)
+    return cached[1]
+
+
+def getChanges(since, fields=None, headers=None):
+    """Receipts written and deleted after ``since``, oldest change first.
+
+    A written receipt is listed in full (or projected to ``fields``, plus
+    ``updated_at``); a deleted one as a tombstone ``{"id", "deleted": true,
+    "updated_at"}``. The ``X-Sync-Cursor`` header is the ``since`` to send
+    next time. Raises ValueError for a bad ``since``.
+    """
+    # A "+" in an unencoded query string arrives as a space
+    moment = to_datetime(since.replace(' ', '+'))
+    if moment is None:
+        raise ValueError('since must be an ISO 8601 timestamp')
+    repository = get_receipt_repository()
+    # Read before the changes: anything committed later is after this cursor
+    state = repository.sync_state()
+    receipts, tombstones = repository.changes_since(moment)
+
+    if fields:
+        fields = tuple(dict.fromkeys(fields + ('updated_at',)))
+    changes = [(receipt['updated_at'], normalize_receipt(receipt, fields)) for receipt in receipts]
+    changes += [(tombstone['deleted_at'],
+                 {'id': tombstone['id'], 'deleted': True, 'updated_at': to_iso(tombstone['deleted_at'])})
+                for tombstone in tombstones]
+    changes.sort(key=lambda change: change[0])
+
+    latest = moment
+    for candidate in (state['updated_at'], changes[-1][0] if changes else None):
+        if candidate and candidate > latest:
+            latest = candidate
+    headers = {**(headers or {}), 'X-Sync-Cursor': sync_cursor(latest)}
+    return Response(stream_json_array(row for _, row in changes), mimetype='application/json',
+                    headers=headers)
+
+
+def queryReceipts(filters, sort=None, limit=None, start_after=None, fields=None, version=None,
+                  headers=None):
+    """Filtered and/or sorted receipt list served from ``get_receipt_columns``.
+
+    Paged like ``getAllReceipts``: ``start_after`` is the id of the last
+    receipt of the previous page, returned in ``X-Next-Cursor``. Raises
+    ValueError for bad filters, sort columns or cursors.
+    """
+    columns = get_receipt_columns(version)
+    by, descending = parse_sort(sort)
+    rows = columns.order(columns.select(**filters), by, descending)
+    if start_after:
+        ids = columns.ids
+        position = next((n for n, row in enumerate(rows) if ids[row] == start_after), None)
+        if position is None:
+            raise ValueError('Invalid cursor')
+        rows = rows[position + 1:]
+
+    limit = min(limit, MAX_PAGE_SIZE) if limit else None
+    page = rows[:limit] if limit else rows
+    next_cursor = columns.ids[page[-1]] if limit and len(page) == limit else None
+    headers = dict(headers or {})
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    body = stream_json_array(normalize_receipt(columns.receipt(row), fields) for row in page)
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+def searchReceipts(query, limit=None, filters=None):
+    """Receipts whose biller or item names contain every word of ``query``
+    (as a prefix), newest first, from the local search index.
+
+    Accepts the ``from``/``to``/``min_total``/``max_total`` filters of
+    ``parse_filters``; raises ValueError for others or for an empty query.
+    """
+    filters = dict(filters or {})
+    unsupported = set(filters) - {'start', 'end', 'min_total', 'max_total'}
+    if unsupported:
+        raise ValueError(f"Search cannot filter by {', '.join(sorted(unsupported))}")
+    started = time.perf_counter()
+    count, results = get_search_index().search(query, limit=limit, **filters)
+    return jsonify({
+        'query': query,
+        'count': count,
+        'results': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
 def getReceiptById(custom_id):
-    # Query documents where ID field matches
-    query = db.collection(collection_name).where(
-        'ID', '==', custom_id).limit(1)
-    results = query.stream()
-
-    # Get the first matching document
-    doc = next(results, None)
-
-    if doc:
-        data = doc.to_dict()
-        return jsonify({
-            'biller_name': data.get('BILLER_NAME'),
-            'bill_value': data.get('BILL_VALUE'),
-            'date': data.get('DATE').isoformat() if data.get('DATE') else None,
-            'items_missed': data.get('ITEMS_MISSED'),
-            'source_id': data.get('SOURCE_ID'),
-            'ID': data.get('ID'),
-            'items': data.get('ITEMS', {})
-
-        })
+    cached = receipt_cache.get(('id', custom_id))
+    if cached is not None:
+        return jsonify(cached)
+
+    data = get_receipt_repository().get(custom_id)
+
+    if data:
+        receipt = normalize_receipt(data)
+        receipt_cache.set(('id', custom_id), receipt)
+        return jsonify(receipt)
     else:
         return jsonify({'error': 'Document with given ID not found'})
 
 
+def getSummary(dimension=None, limit=None, filters=None):
+    """Spend per category, biller and month.
+
+    Without ``filters`` this reads the rollup documents (one per dimension)
+    instead of every receipt; filtered summaries (see ``parse_filters``) are
+    grouped from the columnar snapshot. Raises ValueError for an unknown
+    ``dimension`` or a bad filter.
+    """
+    if dimension and dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}")
+    cache_key = ('summary', dimension, limit, tuple(sorted((filters or {}).items())))
+    summary = receipt_cache.get(cache_key)
+    if summary is None:
+        if filters:
+            columns = get_receipt_columns()
+            rows = columns.select(**filters)
+            rollups = {name: columns.group_by(name, rows) for name in ([dimension] if dimension else DIMENSIONS)}
+        else:
+            rollups = get_receipt_repository().get_rollups()
+        summary = summarize(rollups, dimension, limit)
+        receipt_cache.set(cache_key, summary)
+    return jsonify(summary)
+
+
 def update_receipt(data, item_id):
 
-    allowed_fields = {'transaction_id', 'date', 'biller_name', 'bill_value', 'items'}
+    allowed_fields = {'transaction_id', 'date', 'biller_name', 'bill_value', 'items', 'category'}
     update_data = {}
 
     try:
-        # Find the document with matching ID
-        query = db.collection(collection_name).where(
-            'id', '==', item_id).limit(1)
-        results = query.stream()
-        doc = next(results, None)
         print("LOG::doc", data)
 
-        if not doc:
-            return jsonify({'error': 'Document not found'}), 404
-
-        doc_data = doc.to_dict()
-
         # Validate and prepare update fields
         for field in data:
             if field not in allowed_fields:
@@ -143,7 +560,7 @@ def update_receipt(data, item_id):
             if field == 'date':
                 update_data['date'] = datetime.fromisoformat(data['date'])
 
-            if field == 'items':
+            elif field == 'items':
                 # Merge new items into existing list
                 # existing_items = doc_data.get('items', [])
                 new_items = list(map(convert_to_float, data['items']))
@@ -156,8 +573,14 @@ def update_receipt(data, item_id):
             else:
                 update_data[field] = data[field]
 
-        # Update Firestore document
-        doc.reference.update(update_data)
+        repository = get_receipt_repository()
+        if not repository.update(item_id, update_data, rollup=rollup_changes):
+            return jsonify({'error': 'Document not found'}), 404
+        invalidate_receipts(item_id)
+        if {'biller_name', 'items', 'date', 'bill_value'} & update_data.keys():
+            updated = repository.get(item_id)
+            if updated:
+                index_receipt(updated)
         return jsonify({'message': f'Document with ID={item_id} updated successfully'})
     except Exception as e:
         return jsonify({'error': str(e)})
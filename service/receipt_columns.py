@@ -0,0 +1,235 @@
+import math
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from service.invoice_validation import to_amount
+from service.receipt_dedup import normalize_biller
+from service.receipt_rollups import UNCATEGORIZED
+
+SORT_COLUMNS = ('date', 'bill_value', 'biller_name')
+
+
+def to_datetime(value):
+    """Aware datetime of a datetime or ISO string (naive taken as UTC), or None."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def to_timestamp(value):
+    """POSIX seconds of a datetime or ISO string; -inf when there is no date."""
+    moment = to_datetime(value)
+    return moment.timestamp() if moment is not None else -math.inf
+
+
+def date_bound(value, end=False):
+    """Timestamp for a ``from``/``to`` filter; a date-only ``to`` covers that whole day."""
+    if isinstance(value, str) and len(value) == 10 and end:
+        return to_timestamp(datetime.fromisoformat(value) + timedelta(days=1))
+    timestamp = to_timestamp(value)
+    if timestamp == -math.inf:
+        raise ValueError(f"Invalid date: {value}")
+    return timestamp
+
+
+class StringTable:
+    """Interned strings: each distinct key is stored once and used by code."""
+
+    def __init__(self):
+        self.codes = {}
+        self.keys = []
+        self.labels = []
+
+    def intern(self, key, label=None):
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.labels.append(label or key)
+        return code
+
+    def code(self, key):
+        return self.codes.get(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class ReceiptColumns:
+    """Read-only snapshot of receipts stored column by column.
+
+    Dates (POSIX seconds), totals and month numbers live in typed ``array``
+    columns, billers and categories are interned in ``StringTable`` objects
+    and referenced by code, so a receipt costs a few machine words instead
+    of a dict per receipt plus one per item. Each distinct name also maps to
+    a group (normalized biller / lowercased category, as in the rollups),
+    which is what filters and ``group_by`` compare. Rows are kept in ascending
+    (date, id) order: a date range is two bisections, and newest-first is
+    just the reverse.
+
+    ``select``, ``order`` and ``group_by`` work on lists of row numbers and
+    never build per-receipt dicts; ``receipt`` materializes one row for the
+    API only once it is on the page being returned.
+    """
+
+    def __init__(self, receipts=()):
+        decorated = []
+        for receipt in receipts:
+            moment = to_datetime(receipt.get('date'))
+            decorated.append((moment.timestamp() if moment else -math.inf, receipt.get('id') or '',
+                              moment, receipt))
+        decorated.sort(key=lambda entry: (entry[0], entry[1]))
+        self.dates = array('d')
+        self.totals = array('d')
+        self.months = array('l')
+        self.biller_codes = array('l')
+        self.category_codes = array('l')
+        # Names as written, and the groups they belong to
+        self.billers = StringTable()
+        self.categories = StringTable()
+        self.biller_groups = StringTable()
+        self.category_groups = StringTable()
+        self.biller_group_of = array('l')
+        self.category_group_of = array('l')
+        self.ids = []
+        # Only needed to render a row, kept as references to the source values
+        self.items = []
+        self.transaction_ids = []
+        self.raw_totals = []
+        self.raw_dates = []
+        self.updated = []
+
+        for timestamp, receipt_id, moment, receipt in decorated:
+            self.dates.append(timestamp)
+            total = to_amount(receipt.get('bill_value'))
+            self.totals.append(total if total is not None else 0.0)
+            self.months.append(moment.year * 12 + moment.month - 1 if moment else -1)
+            self.biller_codes.append(self._intern(
+                self.billers, self.biller_groups, self.biller_group_of,
+                str(receipt.get('biller_name') or ''), lambda name: normalize_biller(name) or 'unknown'))
+            self.category_codes.append(self._intern(
+                self.categories, self.category_groups, self.category_group_of,
+                str(receipt.get('category') or ''), lambda name: name.strip().lower() or UNCATEGORIZED))
+            self.ids.append(receipt_id)
+            self.items.append(receipt.get('items'))
+            self.transaction_ids.append(receipt.get('transaction_id'))
+            self.raw_totals.append(receipt.get('bill_value'))
+            self.raw_dates.append(receipt.get('date'))
+            self.updated.append(receipt.get('updated_at'))
+
+    @staticmethod
+    def _intern(names, groups, group_of, name, group_key):
+        code = names.intern(name)
+        if code == len(group_of):
+            # First time this name is seen: work out its group once
+            key = group_key(name)
+            group_of.append(groups.intern(key, name.strip() or key))
+        return code
+
+    def _codes_in_group(self, names, groups, group_of, group_key):
+        group = groups.code(group_key)
+        return {code for code in range(len(names)) if group_of[code] == group}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, start=None, end=None, biller=None, category=None,
+               min_total=None, max_total=None):
+        """Row numbers matching every given condition, oldest first.
+
+        ``start``/``end`` are ISO dates or datetimes (``end`` inclusive for a
+        bare date); ``biller`` matches the normalized biller name.
+        """
+        lo = bisect_left(self.dates, date_bound(start)) if start else 0
+        hi = bisect_left(self.dates, date_bound(end, end=True)) if end else len(self)
+        rows = range(lo, hi)
+
+        if biller is not None:
+            wanted = self._codes_in_group(self.billers, self.biller_groups, self.biller_group_of,
+                                          normalize_biller(biller) or 'unknown')
+            codes = self.biller_codes
+            rows = [i for i in rows if codes[i] in wanted]
+        if category is not None:
+            wanted = self._codes_in_group(self.categories, self.category_groups, self.category_group_of,
+                                          category.strip().lower() or UNCATEGORIZED)
+            codes = self.category_codes
+            rows = [i for i in rows if codes[i] in wanted]
+        totals = self.totals
+        if min_total is not None:
+            rows = [i for i in rows if totals[i] >= min_total]
+        if max_total is not None:
+            rows = [i for i in rows if totals[i] <= max_total]
+        return list(rows)
+
+    def order(self, rows, by='date', descending=True):
+        """``rows`` sorted by one column; ties stay newest (or oldest) first."""
+        if by not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {by}")
+        if by == 'date':
+            # Rows are already in date order
+            return rows[::-1] if descending else list(rows)
+        if by == 'bill_value':
+            column = self.totals
+        else:
+            names = [name.lower() for name in self.billers.keys]
+            column = [names[code] for code in self.biller_codes]
+        return sorted(rows[::-1] if descending else rows, key=column.__getitem__, reverse=descending)
+
+    def group_by(self, dimension, rows=None):
+        """Spend per bucket, in the rollup document format."""
+        rows = range(len(self)) if rows is None else rows
+        totals = self.totals
+        if dimension == 'month':
+            sums, counts = {}, {}
+            months = self.months
+            for i in rows:
+                month = months[i]
+                sums[month] = sums.get(month, 0.0) + totals[i]
+                counts[month] = counts.get(month, 0) + 1
+            buckets = {}
+            for month, count in counts.items():
+                key = 'unknown' if month < 0 else f"{month // 12:04d}-{month % 12 + 1:02d}"
+                buckets[key] = {'total': sums[month], 'count': count, 'label': key}
+            return buckets
+
+        groups, group_of, codes = {
+            'category': (self.category_groups, self.category_group_of, self.category_codes),
+            'biller': (self.biller_groups, self.biller_group_of, self.biller_codes),
+        }[dimension]
+        sums = [0.0] * len(groups)
+        counts = [0] * len(groups)
+        for i in rows:
+            group = group_of[codes[i]]
+            sums[group] += totals[i]
+            counts[group] += 1
+        return {
+            groups.keys[group]: {'total': sums[group], 'count': counts[group], 'label': groups.labels[group]}
+            for group in range(len(groups)) if counts[group]
+        }
+
+    def rollups(self, rows=None):
+        """``group_by`` for every dimension; feed to ``receipt_rollups.summarize``."""
+        return {dimension: self.group_by(dimension, rows) for dimension in ('category', 'biller', 'month')}
+
+    def receipt(self, i):
+        """Row ``i`` as a stored-receipt dict (for ``normalize_receipt``)."""
+        receipt = {
+            'id': self.ids[i],
+            'date': self.raw_dates[i],
+            'bill_value': self.raw_totals[i],
+            'biller_name': self.billers.keys[self.biller_codes[i]],
+            'items': self.items[i] or [],
+        }
+        category = self.categories.keys[self.category_codes[i]]
+        if category:
+            receipt['category'] = category
+        if self.transaction_ids[i]:
+            receipt['transaction_id'] = self.transaction_ids[i]
+        if self.updated[i]:
+            receipt['updated_at'] = self.updated[i]
+        return receipt
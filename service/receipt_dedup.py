@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from service.invoice_validation import to_amount
+from service.receipt_repository import get_receipt_repository
+
+RECEIPT_DEDUP = os.getenv("RECEIPT_DEDUP", "1") == "1"
+# Fields a duplicate may contribute to the receipt already stored
+MERGE_FIELDS = ('transaction_id',)
+# A fingerprint entry whose receipt is missing without a tombstone is only
+# taken over after this long
+FINGERPRINT_STALE_SECONDS = int(os.getenv("FINGERPRINT_STALE_SECONDS", 600))
+
+_BILLER_SUFFIXES = {'pvt', 'private', 'ltd', 'limited', 'inc', 'llc', 'llp', 'co', 'corp'}
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_biller(name):
+    """``"Big Bazaar Pvt. Ltd."`` and ``"BIG BAZAAR"`` both become ``"big bazaar"``."""
+    words = _NON_WORD.sub(" ", str(name or "").lower()).split()
+    while words and words[-1] in _BILLER_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def normalize_date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    try:
+        return datetime.fromisoformat(str(value)).date().isoformat()
+    except ValueError:
+        return str(value or "")[:10]
+
+
+def normalize_amount(value):
+    amount = to_amount(value)
+    return f"{amount:.2f}" if amount is not None else ""
+
+
+def normalize_items(items):
+    """Sorted (name, price) pairs from a list of {item, price} or a name -> price dict."""
+    if isinstance(items, dict):
+        pairs = items.items()
+    elif isinstance(items, list):
+        pairs = [(i.get('item'), i.get('price')) for i in items if isinstance(i, dict)]
+    else:
+        pairs = []
+    return sorted((normalize_biller(name), normalize_amount(price)) for name, price in pairs)
+
+
+def receipt_fingerprint(receipt):
+    """Hash of normalized biller, date, total and item set of a stored receipt."""
+    key = [
+        normalize_biller(receipt.get('biller_name')),
+        normalize_date(receipt.get('date')),
+        normalize_amount(receipt.get('bill_value')),
+        normalize_items(receipt.get('items')),
+    ]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def check_fingerprint(receipt):
+    """Look up ``receipt``'s fingerprint before it is written.
+
+    Returns ``(duplicate_of, claim)``: the id of a stored receipt with the
+    same fingerprint, or None and the ``(key, token)`` claim to pass to the
+    repository write, which records the fingerprint atomically with the
+    receipt (and fails with ``FingerprintTaken`` if a concurrent writer won).
+
+    An entry is only taken over when its receipt was edited to something
+    else, was deleted (has a tombstone), or has been missing for longer than
+    ``FINGERPRINT_STALE_SECONDS`` (deleted outside the API).
+    """
+    repository = get_receipt_repository()
+    fingerprint = receipt_fingerprint(receipt)
+    entry = repository.fingerprints.lookup(fingerprint)
+    if entry is None:
+        return None, (fingerprint, None)
+    holder, token, age = entry
+    stored = repository.get(holder)
+    if stored:
+        if receipt_fingerprint(stored) == fingerprint:
+            return holder, None
+        return None, (fingerprint, token)
+    if repository.is_deleted(holder) or age > FINGERPRINT_STALE_SECONDS:
+        return None, (fingerprint, token)
+    # Written by someone else a moment ago and not readable here yet
+    return holder, None
+
+
+def merge_duplicate(existing_id, receipt):
+    """Copy ``MERGE_FIELDS`` the stored receipt lacks; returns "merged" or "skipped"."""
+    repository = get_receipt_repository()
+    stored = repository.get(existing_id) or {}
+    missing = {field: receipt[field] for field in MERGE_FIELDS
+               if receipt.get(field) and not stored.get(field)}
+    if missing and repository.update(existing_id, missing):
+        return 'merged'
+    return 'skipped'
+
+
+def find_attachment(content_hash):
+    """Id of the receipt already created from this exact file, if it still exists."""
+    repository = get_receipt_repository()
+    receipt_id = repository.attachments.get(content_hash)
+    if receipt_id and repository.get(receipt_id):
+        return receipt_id
+    return None
+
+
+def remember_attachment(content_hash, receipt_id):
+    get_receipt_repository().attachments.put(content_hash, receipt_id)
@@ -0,0 +1,546 @@
+import copy
+import itertools
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, TypedDict
+from service.startup import lazy_import, startup_report
+
+RECEIPT_BACKEND = os.getenv("RECEIPT_BACKEND", "firestore")  # firestore | memory
+COLLECTION_NAME = 'receipt'
+# Duplicate detection indexes (see service.receipt_dedup): key -> receipt id
+FINGERPRINT_COLLECTION = 'receipt_fingerprint'
+ATTACHMENT_COLLECTION = 'receipt_attachment'
+# Spend rollups (see service.receipt_rollups): one document per dimension
+ROLLUP_COLLECTION = 'receipt_rollup'
+# Delta sync: one document per deleted receipt, and a single document whose
+# version is bumped by every receipt write (ETags, see service.receipt)
+TOMBSTONE_COLLECTION = 'receipt_tombstone'
+SYNC_COLLECTION = 'receipt_sync'
+SYNC_DOCUMENT = 'state'
+MAX_BATCH_WRITES = 500  # Firestore limit on writes per batch
+ROLLUP_BATCH_RESERVE = 10  # batch slots kept free for rollup and sync documents
+
+_client = None
+_client_lock = threading.Lock()
+_repository = None
+_repository_lock = threading.Lock()
+
+
+class Receipt(TypedDict, total=False):
+    id: str
+    biller_name: str
+    date: datetime
+    bill_value: object
+    items: list
+    transaction_id: str
+    category: str
+    updated_at: datetime
+
+
+def get_firestore_client():
+    """The process-wide Firestore client, created on first use.
+
+    One client means one gRPC channel pool and one auth handshake shared by
+    every request, the email pipeline and background jobs.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                firestore = lazy_import("google.cloud.firestore")
+                os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "service-account.json")
+                with startup_report.timed("client", "firestore"):
+                    _client = firestore.Client()
+    return _client
+
+
+class FingerprintTaken(Exception):
+    """A receipt write lost its fingerprint to another receipt; nothing was written."""
+
+
+class FirestoreKeyIndex:
+    """Unique key -> receipt id map in its own collection (doc id = key)."""
+
+    def __init__(self, collection_name, client=None):
+        self.collection_name = collection_name
+        self._client = client
+
+    @property
+    def collection(self):
+        return (self._client or get_firestore_client()).collection(self.collection_name)
+
+    def get(self, key: str) -> Optional[str]:
+        doc = self.collection.document(key).get()
+        return doc.to_dict().get('receipt_id') if doc.exists else None
+
+    def lookup(self, key: str):
+        """``(receipt_id, token, age_seconds)`` of an entry, or None.
+
+        ``token`` (the document's update time) lets a receipt write replace
+        exactly this entry and fail if someone else changed it meanwhile.
+        """
+        doc = self.collection.document(key).get()
+        if not doc.exists:
+            return None
+        age = (datetime.now(timezone.utc) - doc.update_time).total_seconds()
+        return doc.to_dict().get('receipt_id'), doc.update_time, age
+
+    def put(self, key: str, receipt_id: str):
+        self.collection.document(key).set({'receipt_id': receipt_id})
+
+
+class InMemoryKeyIndex:
+    """Same interface as ``FirestoreKeyIndex``, backed by a dict."""
+
+    def __init__(self):
+        self._keys = {}
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._keys.get(key)
+            return entry[0] if entry else None
+
+    def lookup(self, key: str):
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                return None
+            receipt_id, token, written_at = entry
+            return receipt_id, token, time.time() - written_at
+
+    def put(self, key: str, receipt_id: str):
+        with self._lock:
+            self._keys[key] = (receipt_id, next(self._tokens), time.time())
+
+    def swap(self, key: str, receipt_id: str, token=None) -> bool:
+        """Point ``key`` at ``receipt_id`` if it is unset (``token`` None) or still at ``token``."""
+        with self._lock:
+            entry = self._keys.get(key)
+            if (entry[1] if entry else None) != token:
+                return False
+            self._keys[key] = (receipt_id, next(self._tokens), time.time())
+            return True
+
+
+class FirestoreReceiptRepository:
+    """Receipt operations on the ``receipt`` collection, keyed by receipt id.
+
+    ``fingerprints`` and ``attachments`` are the duplicate detection indexes
+    that live next to it. ``add``/``add_many`` take ``(key, token)``
+    fingerprint claims from ``service.receipt_dedup.check_fingerprint`` and
+    write the index entry in the receipt's batch: ``create()`` for a new key,
+    an update preconditioned on ``token`` to take over a stale one. If
+    another writer got there first the whole batch fails with
+    ``FingerprintTaken`` and neither the receipt nor the entry is written.
+
+    Write methods take an optional ``rollup(changes)`` callable that maps a
+    list of ``(old, new)`` receipt pairs to rollup increments (see
+    ``service.receipt_rollups.rollup_changes``); the increments are written
+    in the same batch or transaction as the receipts themselves.
+
+    Every write also stamps ``updated_at`` on the receipts it touches, leaves
+    a tombstone for each deleted one and bumps the sync state, all with the
+    commit's server timestamp so ``changes_since`` cursors are consistent
+    across processes.
+    """
+
+    def __init__(self, collection_name=COLLECTION_NAME, client=None):
+        self.collection_name = collection_name
+        self._client = client
+        self.fingerprints = FirestoreKeyIndex(FINGERPRINT_COLLECTION, client)
+        self.attachments = FirestoreKeyIndex(ATTACHMENT_COLLECTION, client)
+
+    @property
+    def client(self):
+        return self._client or get_firestore_client()
+
+    @property
+    def collection(self):
+        return self.client.collection(self.collection_name)
+
+    def get(self, receipt_id: str) -> Optional[Receipt]:
+        doc = self.collection.document(receipt_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def _apply_rollup(self, writer, deltas):
+        """Queue rollup increments on a WriteBatch or Transaction."""
+        from google.cloud import firestore
+        rollups = self.client.collection(ROLLUP_COLLECTION)
+        for dimension, buckets in deltas.items():
+            writer.set(rollups.document(dimension), {'buckets': {
+                key: {
+                    'total': firestore.Increment(delta['total']),
+                    'count': firestore.Increment(delta['count']),
+                    'label': delta['label'],
+                }
+                for key, delta in buckets.items()
+            }}, merge=True)
+
+    def _touch(self, writer):
+        """Queue the sync state bump that goes with every receipt write."""
+        from google.cloud import firestore
+        writer.set(self.client.collection(SYNC_COLLECTION).document(SYNC_DOCUMENT), {
+            'version': firestore.Increment(1),
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+
+    @staticmethod
+    def _stamped(receipt):
+        from google.cloud import firestore
+        return {**receipt, 'updated_at': firestore.SERVER_TIMESTAMP}
+
+    def _apply_fingerprint(self, batch, fingerprint, receipt_id):
+        """Queue the fingerprint index entry of a new receipt."""
+        key, token = fingerprint
+        ref = self.fingerprints.collection.document(key)
+        if token is None:
+            batch.create(ref, {'receipt_id': receipt_id})
+        else:
+            batch.update(ref, {'receipt_id': receipt_id},
+                         option=self.client.write_option(last_update_time=token))
+
+    def _commit(self, batch):
+        from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
+        try:
+            batch.commit()
+        except (Conflict, FailedPrecondition, NotFound) as e:
+            # Receipts are set(), so only a fingerprint create/update can lose
+            raise FingerprintTaken(str(e)) from e
+
+    def add(self, receipt: Receipt, rollup=None, fingerprint=None) -> str:
+        batch = self.client.batch()
+        batch.set(self.collection.document(receipt['id']), self._stamped(receipt))
+        if fingerprint:
+            self._apply_fingerprint(batch, fingerprint, receipt['id'])
+        if rollup:
+            self._apply_rollup(batch, rollup([(None, receipt)]))
+        self._touch(batch)
+        self._commit(batch)
+        return receipt['id']
+
+    def add_many(self, receipts: list, rollup=None, fingerprints=None) -> list:
+        """Write receipts in batches; returns an error string or None per receipt.
+
+        ``fingerprints`` has one claim (or None) per receipt. A chunk that
+        loses a fingerprint is written again one receipt at a time, so only
+        the duplicates fail (with a ``FingerprintTaken`` message).
+        """
+        errors = [None] * len(receipts)
+        fingerprints = fingerprints or [None] * len(receipts)
+        collection = self.collection
+        # Leave room in every batch for the rollup and sync documents; a
+        # fingerprint entry takes a second write per receipt
+        chunk_size = (MAX_BATCH_WRITES - ROLLUP_BATCH_RESERVE) // (2 if any(fingerprints) else 1)
+        for start in range(0, len(receipts), chunk_size):
+            chunk = receipts[start:start + chunk_size]
+            claims = fingerprints[start:start + chunk_size]
+            batch = self.client.batch()
+            for receipt, fingerprint in zip(chunk, claims):
+                batch.set(collection.document(receipt['id']), self._stamped(receipt))
+                if fingerprint:
+                    self._apply_fingerprint(batch, fingerprint, receipt['id'])
+            if rollup:
+                self._apply_rollup(batch, rollup([(None, receipt) for receipt in chunk]))
+            self._touch(batch)
+            try:
+                self._commit(batch)
+            except FingerprintTaken:
+                for offset, (receipt, fingerprint) in enumerate(zip(chunk, claims)):
+                    try:
+                        self.add(receipt, rollup, fingerprint)
+                    except Exception as e:
+                        errors[start + offset] = str(e) or type(e).__name__
+            except Exception as e:
+                # A batch is atomic, so the whole chunk failed
+                for offset in range(len(chunk)):
+                    errors[start + offset] = str(e)
+        return errors
+
+    def update(self, receipt_id: str, fields: dict, rollup=None) -> bool:
+        """Apply a partial update; False if the receipt does not exist."""
+        from google.api_core.exceptions import NotFound
+        from google.cloud import firestore
+        ref = self.collection.document(receipt_id)
+        if rollup is None:
+            batch = self.client.batch()
+            batch.update(ref, self._stamped(fields))
+            self._touch(batch)
+            try:
+                batch.commit()
+            except NotFound:
+                return False
+            return True
+
+        @firestore.transactional
+        def update_in(transaction):
+            # Reading the old version in the transaction keeps the rollups exact
+            snapshot = ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            old = snapshot.to_dict()
+            transaction.update(ref, self._stamped(fields))
+            self._apply_rollup(transaction, rollup([(old, {**old, **fields})]))
+            self._touch(transaction)
+            return True
+
+        return update_in(self.client.transaction())
+
+    def delete_many(self, receipt_ids: list, rollup=None):
+        from google.cloud import firestore
+        collection = self.collection
+        tombstones = self.client.collection(TOMBSTONE_COLLECTION)
+        # Two writes per receipt: the delete and its tombstone
+        chunk_size = (MAX_BATCH_WRITES - ROLLUP_BATCH_RESERVE) // 2
+        for start in range(0, len(receipt_ids), chunk_size):
+            refs = [collection.document(receipt_id)
+                    for receipt_id in receipt_ids[start:start + chunk_size]]
+            batch = self.client.batch()
+            for ref in refs:
+                batch.delete(ref)
+                batch.set(tombstones.document(ref.id),
+                          {'id': ref.id, 'deleted_at': firestore.SERVER_TIMESTAMP})
+            if rollup:
+                old = [doc.to_dict() for doc in self.client.get_all(refs) if doc.exists]
+                self._apply_rollup(batch, rollup([(receipt, None) for receipt in old]))
+            self._touch(batch)
+            batch.commit()
+
+    def is_deleted(self, receipt_id: str) -> bool:
+        """Whether the receipt was deleted through ``delete_many`` (has a tombstone)."""
+        return self.client.collection(TOMBSTONE_COLLECTION).document(receipt_id).get().exists
+
+    def sync_state(self) -> dict:
+        """``{"version", "updated_at"}`` of the last receipt write (0/None before any)."""
+        doc = self.client.collection(SYNC_COLLECTION).document(SYNC_DOCUMENT).get()
+        state = doc.to_dict() if doc.exists else {}
+        return {'version': state.get('version', 0), 'updated_at': state.get('updated_at')}
+
+    def changes_since(self, since: datetime):
+        """Receipts written and ids deleted after ``since``, oldest change first.
+
+        Returns ``(receipts, tombstones)``; each tombstone is
+        ``{"id", "deleted_at"}``. Receipts stored before ``updated_at``
+        existed only show up here once they are written again.
+        """
+        from google.cloud import firestore
+        receipts = self.collection.where(
+            filter=firestore.FieldFilter('updated_at', '>', since)).order_by('updated_at')
+        tombstones = self.client.collection(TOMBSTONE_COLLECTION).where(
+            filter=firestore.FieldFilter('deleted_at', '>', since)).order_by('deleted_at')
+        return ([doc.to_dict() for doc in receipts.stream()],
+                [doc.to_dict() for doc in tombstones.stream()])
+
+    def get_rollups(self) -> dict:
+        """``{dimension: {key: {"total", "count", "label"}}}`` as stored."""
+        return {doc.id: doc.to_dict().get('buckets', {})
+                for doc in self.client.collection(ROLLUP_COLLECTION).stream()}
+
+    def replace_rollups(self, rollups: dict):
+        """Overwrite every rollup document, e.g. after a rebuild."""
+        collection = self.client.collection(ROLLUP_COLLECTION)
+        batch = self.client.batch()
+        for doc in collection.list_documents():
+            if doc.id not in rollups:
+                batch.delete(doc)
+        for dimension, buckets in rollups.items():
+            batch.set(collection.document(dimension), {'buckets': buckets})
+        batch.commit()
+
+    def _list_query(self, start_after=None, fields=None):
+        from google.cloud import firestore
+        query = self.collection.order_by('date', direction=firestore.Query.DESCENDING)
+        if fields:
+            # date is the order key, Firestore needs it even if not returned
+            query = query.select(list(dict.fromkeys(list(fields) + ['date'])))
+        if start_after:
+            cursor_doc = self.collection.document(start_after).get()
+            if not cursor_doc.exists:
+                raise ValueError('Invalid cursor')
+            query = query.start_after(cursor_doc)
+        return query
+
+    def list(self, limit: int = None, start_after: str = None, fields=None):
+        """One page of receipts, newest first.
+
+        Returns ``(receipts, next_cursor)``; ``next_cursor`` is the key of the
+        last receipt when the page is full. Raises ValueError for an unknown
+        cursor.
+        """
+        query = self._list_query(start_after, fields)
+        if limit:
+            query = query.limit(limit)
+
+        docs = list(query.stream())
+        next_cursor = docs[-1].id if limit and len(docs) == limit else None
+        return [doc.to_dict() for doc in docs], next_cursor
+
+    def stream(self, start_after: str = None, fields=None):
+        """Every receipt after ``start_after``, newest first, read lazily from
+        the query stream. The cursor is checked right away (ValueError)."""
+        query = self._list_query(start_after, fields)
+        return (doc.to_dict() for doc in query.stream())
+
+
+class InMemoryReceiptRepository:
+    """Same interface as ``FirestoreReceiptRepository``, backed by a dict.
+
+    For local runs, benchmarks and tests that should not touch Firestore.
+    """
+
+    def __init__(self):
+        self._receipts = {}
+        self._lock = threading.Lock()
+        self.fingerprints = InMemoryKeyIndex()
+        self.attachments = InMemoryKeyIndex()
+        self._rollups = {}
+        self._tombstones = {}
+        self._version = 0
+        self._updated_at = None
+
+    def _touch(self):
+        """Next ``updated_at``, strictly after the previous one; caller holds the lock."""
+        now = datetime.now(timezone.utc)
+        if self._updated_at and now <= self._updated_at:
+            now = self._updated_at + timedelta(microseconds=1)
+        self._version += 1
+        self._updated_at = now
+        return now
+
+    def _apply_rollup(self, deltas):
+        # Caller holds the lock
+        for dimension, buckets in deltas.items():
+            stored = self._rollups.setdefault(dimension, {})
+            for key, delta in buckets.items():
+                bucket = stored.setdefault(key, {'total': 0.0, 'count': 0, 'label': delta['label']})
+                bucket['total'] += delta['total']
+                bucket['count'] += delta['count']
+                bucket['label'] = delta['label']
+
+    def get(self, receipt_id: str) -> Optional[Receipt]:
+        with self._lock:
+            receipt = self._receipts.get(receipt_id)
+            return copy.deepcopy(receipt) if receipt else None
+
+    def add(self, receipt: Receipt, rollup=None, fingerprint=None) -> str:
+        with self._lock:
+            if fingerprint and not self.fingerprints.swap(fingerprint[0], receipt['id'], fingerprint[1]):
+                raise FingerprintTaken(fingerprint[0])
+            self._receipts[receipt['id']] = {**copy.deepcopy(receipt), 'updated_at': self._touch()}
+            if rollup:
+                self._apply_rollup(rollup([(None, receipt)]))
+        return receipt['id']
+
+    def add_many(self, receipts: list, rollup=None, fingerprints=None) -> list:
+        errors = []
+        for receipt, fingerprint in zip(receipts, fingerprints or [None] * len(receipts)):
+            try:
+                self.add(receipt, rollup, fingerprint)
+                errors.append(None)
+            except FingerprintTaken as e:
+                errors.append(f"FingerprintTaken: {e}")
+        return errors
+
+    def update(self, receipt_id: str, fields: dict, rollup=None) -> bool:
+        with self._lock:
+            if receipt_id not in self._receipts:
+                return False
+            old = copy.deepcopy(self._receipts[receipt_id])
+            self._receipts[receipt_id].update(copy.deepcopy(fields), updated_at=self._touch())
+            if rollup:
+                self._apply_rollup(rollup([(old, self._receipts[receipt_id])]))
+            return True
+
+    def delete_many(self, receipt_ids: list, rollup=None):
+        with self._lock:
+            for receipt_id in receipt_ids:
+                old = self._receipts.pop(receipt_id, None)
+                self._tombstones[receipt_id] = self._touch()
+                if old and rollup:
+                    self._apply_rollup(rollup([(old, None)]))
+
+    def is_deleted(self, receipt_id: str) -> bool:
+        with self._lock:
+            return receipt_id in self._tombstones
+
+    def sync_state(self) -> dict:
+        with self._lock:
+            return {'version': self._version, 'updated_at': self._updated_at}
+
+    def changes_since(self, since: datetime):
+        with self._lock:
+            receipts = sorted((r for r in self._receipts.values() if r['updated_at'] > since),
+                              key=lambda r: r['updated_at'])
+            tombstones = sorted(({'id': receipt_id, 'deleted_at': deleted_at}
+                                 for receipt_id, deleted_at in self._tombstones.items()
+                                 if deleted_at > since), key=lambda t: t['deleted_at'])
+            return copy.deepcopy(receipts), tombstones
+
+    def get_rollups(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._rollups)
+
+    def replace_rollups(self, rollups: dict):
+        with self._lock:
+            self._rollups = copy.deepcopy(rollups)
+
+    def list(self, limit: int = None, start_after: str = None, fields=None):
+        with self._lock:
+            # Firestore leaves out documents without the order field and
+            # sorts a null date below every timestamp
+            ordered = sorted(
+                (r for r in self._receipts.values() if 'date' in r),
+                key=lambda r: (r['date'] is not None,
+                               r['date'].isoformat() if isinstance(r['date'], datetime)
+                               else str(r['date'] or ''), r['id']),
+                reverse=True
+            )
+            if start_after:
+                ids = [r['id'] for r in ordered]
+                if start_after not in ids:
+                    raise ValueError('Invalid cursor')
+                ordered = ordered[ids.index(start_after) + 1:]
+            page = ordered[:limit] if limit else ordered
+            next_cursor = page[-1]['id'] if limit and len(page) == limit else None
+            if fields:
+                page = [{k: r[k] for k in fields if k in r} for r in page]
+            return copy.deepcopy(page), next_cursor
+
+    def stream(self, start_after: str = None, fields=None):
+        receipts, _ = self.list(None, start_after, fields)
+        return iter(receipts)
+
+
+def iter_receipts(repository, page_size=MAX_BATCH_WRITES):
+    """Every receipt in ``repository``, newest first, read ``page_size`` at a time."""
+    cursor = None
+    while True:
+        receipts, cursor = repository.list(page_size, cursor)
+        yield from receipts
+        if not cursor:
+            break
+
+
+def get_receipt_repository():
+    """The shared repository selected by ``RECEIPT_BACKEND``."""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                backends = {
+                    "firestore": FirestoreReceiptRepository,
+                    "memory": InMemoryReceiptRepository,
+                }
+                if RECEIPT_BACKEND not in backends:
+                    raise ValueError(f"Unknown RECEIPT_BACKEND: {RECEIPT_BACKEND}")
+                _repository = backends[RECEIPT_BACKEND]()
+    return _repository
+
+
+def set_receipt_repository(repository):
+    """Swap the shared repository, e.g. for an in-memory one in a benchmark."""
+    global _repository
+    _repository = repository
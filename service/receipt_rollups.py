@@ -0,0 +1,113 @@
+from datetime import datetime
+from service.invoice_validation import to_amount
+from service.receipt_dedup import normalize_biller
+
+# One rollup document per dimension, holding one bucket per key
+DIMENSIONS = ('category', 'biller', 'month')
+UNCATEGORIZED = 'uncategorized'
+
+
+def receipt_month(value):
+    """``YYYY-MM`` of a stored receipt date, or "unknown"."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m')
+    try:
+        return datetime.fromisoformat(str(value)).strftime('%Y-%m')
+    except ValueError:
+        return 'unknown'
+
+
+def receipt_buckets(receipt):
+    """``{dimension: (key, label)}`` a receipt counts towards."""
+    category = str(receipt.get('category') or UNCATEGORIZED).strip().lower() or UNCATEGORIZED
+    biller_name = str(receipt.get('biller_name') or '').strip()
+    month = receipt_month(receipt.get('date'))
+    return {
+        'category': (category, category),
+        'biller': (normalize_biller(biller_name) or 'unknown', biller_name or 'unknown'),
+        'month': (month, month),
+    }
+
+
+def rollup_delta(old, new):
+    """Bucket increments for replacing receipt ``old`` with ``new``.
+
+    Either side may be None (an add or a delete). Returns
+    ``{dimension: {key: {"total", "count", "label"}}}``; buckets that do not
+    change are left out, so editing e.g. only ``transaction_id`` is a no-op.
+    """
+    deltas = {}
+    for receipt, sign in ((old, -1), (new, 1)):
+        if not receipt:
+            continue
+        amount = to_amount(receipt.get('bill_value')) or 0.0
+        for dimension, (key, label) in receipt_buckets(receipt).items():
+            bucket = deltas.setdefault(dimension, {}).setdefault(
+                key, {'total': 0.0, 'count': 0, 'label': label})
+            bucket['total'] += sign * amount
+            bucket['count'] += sign
+            if sign > 0:
+                bucket['label'] = label
+    for dimension in list(deltas):
+        deltas[dimension] = {key: b for key, b in deltas[dimension].items()
+                             if b['count'] or abs(b['total']) > 1e-9}
+        if not deltas[dimension]:
+            del deltas[dimension]
+    return deltas
+
+
+def merge_deltas(deltas_list):
+    """Sum several ``rollup_delta`` results, e.g. for one write batch."""
+    merged = {}
+    for deltas in deltas_list:
+        for dimension, buckets in deltas.items():
+            for key, delta in buckets.items():
+                bucket = merged.setdefault(dimension, {}).setdefault(
+                    key, {'total': 0.0, 'count': 0, 'label': delta['label']})
+                bucket['total'] += delta['total']
+                bucket['count'] += delta['count']
+                bucket['label'] = delta['label']
+    return merged
+
+
+def summarize(rollups, dimension=None, limit=None):
+    """Shape stored rollups for ``/receipt/summary``.
+
+    Categories and billers are sorted by spend, months chronologically.
+    Empty buckets (everything in them edited away or deleted) are dropped.
+    ``total`` and ``count`` cover every receipt, whatever ``limit`` is.
+    """
+    summary = {}
+    grand_total = grand_count = 0
+    for name in ([dimension] if dimension else DIMENSIONS):
+        rows = [
+            {'key': key, 'label': bucket.get('label', key),
+             'total': round(bucket.get('total', 0.0), 2), 'count': bucket.get('count', 0)}
+            for key, bucket in rollups.get(name, {}).items()
+            if bucket.get('count', 0) > 0
+        ]
+        # Every receipt is in exactly one bucket per dimension
+        grand_total = sum(row['total'] for row in rows)
+        grand_count = sum(row['count'] for row in rows)
+        if name == 'month':
+            rows.sort(key=lambda row: row['key'])
+        else:
+            rows.sort(key=lambda row: (-row['total'], row['key']))
+        summary[name] = rows[:limit] if limit else rows
+
+    summary['total'] = round(grand_total, 2)
+    summary['count'] = grand_count
+    return summary
+
+
+def rollup_changes(changes):
+    """Merged increments for a list of ``(old, new)`` receipt pairs.
+
+    This is the ``rollup`` callable the repository write methods take.
+    """
+    return merge_deltas(rollup_delta(old, new) for old, new in changes)
+
+
+def build_rollups(receipts):
+    """Rollups of ``receipts`` from scratch, in the stored format."""
+    return merge_deltas(rollup_delta(None, receipt) for receipt in receipts)
@@ -0,0 +1,304 @@
+import json
+import math
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from pathlib import Path
+from service.invoice_validation import to_amount
+from service.receipt_columns import date_bound, to_datetime
+from service.receipt_repository import get_receipt_repository, iter_receipts
+from service.startup import startup_report
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, use one process per index file
+    fcntl = None
+
+# Snapshot file of the index; every change since the snapshot is appended to
+# "<path>.log" and replayed on startup. Empty disables persistence.
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "receipt_search.json")
+# Fold the change log into a new snapshot after this many entries
+SEARCH_INDEX_COMPACT_EVERY = int(os.getenv("SEARCH_INDEX_COMPACT_EVERY", 1000))
+SEARCH_MAX_RESULTS = 100
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class SearchIndexNotBuilt(Exception):
+    """The index has no snapshot and could not be built from the receipts."""
+
+
+def tokenize(text):
+    """Lowercased word tokens of ``text``; single letters are dropped."""
+    return [token for token in _TOKEN.findall(str(text or "").lower()) if len(token) > 1 or token.isdigit()]
+
+
+def receipt_text(receipt):
+    """Biller name and item names, the searchable part of a receipt."""
+    items = receipt.get('items')
+    if isinstance(items, dict):
+        names = list(items)
+    elif isinstance(items, list):
+        names = [item.get('item') for item in items if isinstance(item, dict)]
+    else:
+        names = []
+    return " ".join([str(receipt.get('biller_name') or "")] + [str(name or "") for name in names])
+
+
+def index_document(receipt):
+    """What the index keeps for one receipt: its tokens and what a hit shows."""
+    moment = to_datetime(receipt.get('date'))
+    return {
+        "tokens": sorted(set(tokenize(receipt_text(receipt)))),
+        "biller_name": receipt.get('biller_name'),
+        "date": moment.isoformat() if moment else None,
+        "timestamp": moment.timestamp() if moment else None,
+        "total": to_amount(receipt.get('bill_value')),
+    }
+
+
+class SearchIndex:
+    """Inverted index from biller/item tokens to receipt ids.
+
+    ``postings`` maps each token to the ids containing it, and a sorted
+    vocabulary makes prefix lookups a bisection. Per receipt only what
+    search results show is kept (biller, date, total), so queries never touch
+    the receipt store.
+
+    With a ``path`` the index survives restarts without a collection scan:
+    ``add``/``remove`` append one JSON line to ``<path>.log``, and the log is
+    folded into the ``path`` snapshot every ``compact_every`` entries.
+
+    Several processes (the web app and the mail listener) may share the
+    files. Appends and compaction hold an exclusive lock on ``<path>.lock``,
+    and compaction first reloads the snapshot and log from disk, so the new
+    snapshot holds every process's entries rather than only this one's.
+    Changes made by another process show up here after the next compaction
+    or a restart.
+
+    ``built`` is False until a snapshot has been loaded or ``rebuild`` has
+    run; a change log alone may cover only part of the receipts.
+    """
+
+    def __init__(self, path=None, compact_every=SEARCH_INDEX_COMPACT_EVERY):
+        self.path = Path(path) if path else None
+        self.compact_every = compact_every
+        self.postings = {}
+        self.vocabulary = []
+        self.docs = {}
+        self._log_entries = 0
+        self.built = False
+        self._lock = threading.RLock()
+        if self.path:
+            self._load()
+
+    def __len__(self):
+        return len(self.docs)
+
+    # -- persistence -------------------------------------------------------
+
+    @property
+    def log_path(self):
+        return self.path.with_name(self.path.name + ".log")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the index files, shared with other processes."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self):
+        with self._file_lock():
+            self._read_files()
+
+    def _read_files(self):
+        # Caller holds the file lock
+        self.postings, self.vocabulary, self.docs = {}, [], {}
+        self._log_entries = 0
+        if self.path.exists():
+            with open(self.path) as f:
+                for receipt_id, doc in json.load(f).get("docs", {}).items():
+                    self._add(receipt_id, doc)
+            self.built = True
+        if self.log_path.exists():
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A write cut short by a crash; everything before it is fine
+                        continue
+                    self._remove(entry["id"])
+                    if entry.get("doc"):
+                        self._add(entry["id"], entry["doc"])
+                    self._log_entries += 1
+
+    def _log(self, receipt_id, doc):
+        if not self.path:
+            return
+        with self._file_lock():
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({"id": receipt_id, "doc": doc}) + "\n")
+        self._log_entries += 1
+        if self._log_entries >= self.compact_every:
+            self.save()
+
+    def _write_snapshot(self):
+        # Caller holds the file lock
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"docs": self.docs}, f)
+        os.replace(tmp_path, self.path)
+        if self.log_path.exists():
+            self.log_path.unlink()
+        self._log_entries = 0
+
+    def save(self):
+        """Fold the change log of every process into a new snapshot.
+
+        The snapshot and log are re-read under the file lock first, which
+        also picks up what other processes indexed since this one loaded.
+        """
+        if not self.path:
+            return
+        with self._lock, self._file_lock():
+            self._read_files()
+            self._write_snapshot()
+
+    # -- updates -----------------------------------------------------------
+
+    def _add(self, receipt_id, doc):
+        self.docs[receipt_id] = doc
+        for token in doc["tokens"]:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                insort(self.vocabulary, token)
+            ids.add(receipt_id)
+
+    def _remove(self, receipt_id):
+        doc = self.docs.pop(receipt_id, None)
+        if doc is None:
+            return
+        for token in doc["tokens"]:
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(receipt_id)
+            if not ids:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def add(self, receipt):
+        """Index (or re-index) one stored receipt."""
+        doc = index_document(receipt)
+        with self._lock:
+            self._remove(receipt['id'])
+            self._add(receipt['id'], doc)
+            self._log(receipt['id'], doc)
+
+    def remove(self, receipt_id):
+        with self._lock:
+            if receipt_id in self.docs:
+                self._remove(receipt_id)
+                self._log(receipt_id, None)
+
+    def rebuild(self, receipts):
+        """Replace the whole index, e.g. from a full collection scan."""
+        with self._lock:
+            self.postings, self.vocabulary, self.docs = {}, [], {}
+            for receipt in receipts:
+                self._add(receipt['id'], index_document(receipt))
+            if self.path:
+                with self._file_lock():
+                    self._write_snapshot()
+            self.built = True
+
+    # -- queries -----------------------------------------------------------
+
+    def _matching(self, token):
+        """Ids of receipts with a token starting with ``token``."""
+        vocabulary = self.vocabulary
+        position = bisect_left(vocabulary, token)
+        ids = set()
+        while position < len(vocabulary) and vocabulary[position].startswith(token):
+            ids |= self.postings[vocabulary[position]]
+            position += 1
+        return ids
+
+    def search(self, query, start=None, end=None, min_total=None, max_total=None,
+               limit=20):
+        """Receipts containing every query token as a word prefix, newest first.
+
+        Returns ``(total_matches, hits)``; each hit has ``id``,
+        ``biller_name``, ``date`` and ``bill_value``. Raises ValueError for
+        an empty query or a bad date.
+        """
+        tokens = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not tokens:
+            raise ValueError("Query has no searchable words")
+        low = date_bound(start) if start else -math.inf
+        high = date_bound(end, end=True) if end else math.inf
+
+        with self._lock:
+            # Longest tokens first: usually the rarest, so the set shrinks fast
+            ids = None
+            for token in tokens:
+                matching = self._matching(token)
+                ids = matching if ids is None else ids & matching
+                if not ids:
+                    return 0, []
+
+            hits = []
+            for receipt_id in ids:
+                doc = self.docs[receipt_id]
+                timestamp = doc["timestamp"] if doc["timestamp"] is not None else -math.inf
+                if not low <= timestamp < high:
+                    continue
+                total = doc["total"]
+                if min_total is not None and (total is None or total < min_total):
+                    continue
+                if max_total is not None and (total is None or total > max_total):
+                    continue
+                hits.append((timestamp, receipt_id, doc))
+
+        hits.sort(key=lambda hit: (hit[0], hit[1]), reverse=True)
+        return len(hits), [
+            {"id": receipt_id, "biller_name": doc["biller_name"], "date": doc["date"], "bill_value": doc["total"]}
+            for _, receipt_id, doc in hits[:min(limit or SEARCH_MAX_RESULTS, SEARCH_MAX_RESULTS)]
+        ]
+
+
+def get_search_index():
+    """The shared ``SearchIndex``, loaded from ``SEARCH_INDEX_PATH`` on first use.
+
+    Without a snapshot on disk (a new container, or no ``SEARCH_INDEX_PATH``)
+    it is built from a scan of the receipts first, so searches never answer
+    from an empty index. Raises ``SearchIndexNotBuilt`` if the scan fails;
+    the next call tries again.
+    """
+    global _index
+    if _index is None or not _index.built:
+        with _index_lock:
+            if _index is None:
+                with startup_report.timed("client", "search_index"):
+                    _index = SearchIndex(SEARCH_INDEX_PATH or None)
+            if not _index.built:
+                try:
+                    with startup_report.timed("client", "search_index_rebuild"):
+                        _index.rebuild(iter_receipts(get_receipt_repository()))
+                except Exception as e:
+                    raise SearchIndexNotBuilt(f"Search index is not built yet: {e}") from e
+    return _index
@@ -0,0 +1,95 @@
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Load the heavy SDKs and clients in a background thread right after startup
+# instead of on the first request that needs them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"
+# Modules worth loading ahead of time; everything else is imported on use
+WARMUP_MODULES = ("google.generativeai", "google.api_core.exceptions", "fitz", "PIL.Image", "PIL.ImageOps")
+
+
+class StartupReport:
+    """How long each import and client creation took, and when the app got ready.
+
+    ``imports`` and ``clients`` map a name to seconds and ``phase`` ("startup"
+    before ``mark_ready``, then "warmup" or "first_use"), so the report shows
+    what a cold start paid for and what was deferred.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready_seconds = None
+        self.imports = {}
+        self.clients = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _phase(self):
+        if self.ready_seconds is None:
+            return "startup"
+        return "warmup" if getattr(self._local, "warmup", False) else "first_use"
+
+    def record(self, kind, name, seconds):
+        with self._lock:
+            entries = self.imports if kind == "import" else self.clients
+            entries.setdefault(name, {"seconds": round(seconds, 4), "phase": self._phase()})
+
+    @contextmanager
+    def timed(self, kind, name):
+        """Record how long the block took; a block that raises is not recorded."""
+        started = time.perf_counter()
+        yield
+        self.record(kind, name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        """The app can serve requests; later loads count as deferred."""
+        if self.ready_seconds is None:
+            self.ready_seconds = round(time.perf_counter() - self.started_at, 4)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready_seconds": self.ready_seconds,
+                "imports": dict(sorted(self.imports.items(), key=lambda kv: -kv[1]["seconds"])),
+                "clients": dict(sorted(self.clients.items(), key=lambda kv: -kv[1]["seconds"])),
+            }
+
+
+startup_report = StartupReport()
+
+
+def lazy_import(name):
+    """``importlib.import_module`` that records the first, expensive import."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with startup_report.timed("import", name):
+        return importlib.import_module(name)
+
+
+def warmup(steps=()):
+    """Import ``WARMUP_MODULES`` and run ``steps`` (client factories) in a daemon thread.
+
+    A failing step is reported and skipped; the request that needs it will
+    try again and surface the error.
+    """
+    def run():
+        startup_report._local.warmup = True
+        for name in WARMUP_MODULES:
+            try:
+                lazy_import(name)
+            except Exception as e:
+                print(f"⚠️ Warmup could not import {name}: {e}")
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                print(f"⚠️ Warmup step {getattr(step, '__name__', step)} failed: {e}")
+
+    thread = threading.Thread(target=run, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread